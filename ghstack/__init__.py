@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 
 import sys
+from typing import Any
 
-if sys.version_info >= (3, 8):
-    import importlib.metadata as importlib_metadata
-else:
-    import importlib_metadata
 
-__version__ = importlib_metadata.version("ghstack")  # type: ignore[no-untyped-call]
+def __getattr__(name: str) -> Any:
+    # Looking up our version in the installed package metadata is
+    # surprisingly slow, so only do it when someone actually asks
+    if name == "__version__":
+        if sys.version_info >= (3, 8):
+            import importlib.metadata as importlib_metadata
+        else:
+            import importlib_metadata
+
+        version = importlib_metadata.version("ghstack")  # type: ignore[no-untyped-call]
+        globals()["__version__"] = version
+        return version
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
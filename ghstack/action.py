@@ -3,10 +3,29 @@
 import logging
 from typing import Optional
 
+import ghstack.cache
 import ghstack.github
 import ghstack.github_utils
 import ghstack.shell
 
+PR_ID_QUERY = """
+    query ($owner: String!, $name: String!, $number: Int!) {
+        repository(name: $name, owner: $owner) {
+            pullRequest(number: $number) {
+                id
+            }
+        }
+    }
+"""
+
+CLOSE_PR_MUTATION = """
+    mutation ($input: ClosePullRequestInput!) {
+        closePullRequest(input: $input) {
+            clientMutationId
+        }
+    }
+"""
+
 
 def main(
     pull_request: str,
@@ -16,29 +35,23 @@ def main(
 ) -> None:
 
     params = ghstack.github_utils.parse_pull_request(pull_request)
-    pr_result = github.graphql(
-        """
-        query ($owner: String!, $name: String!, $number: Int!) {
-            repository(name: $name, owner: $owner) {
-                pullRequest(number: $number) {
-                    id
-                }
-            }
-        }
-    """,
-        **params
+
+    # NB: the only action we support needs the node id of the pull request,
+    # so don't bother looking it up if there's nothing to do
+    if not close:
+        return
+
+    # NB: the node id of a pull request never changes, so we can cache it
+    # indefinitely
+    key = "{github_url}/{owner}/{name}/{number}".format(**params)
+    pr_id = ghstack.cache.get("github_pr_id", key)
+    if pr_id is None:
+        pr_result = github.graphql(PR_ID_QUERY, **params)
+        pr_id = pr_result["data"]["repository"]["pullRequest"]["id"]
+        ghstack.cache.put("github_pr_id", key, pr_id)
+
+    logging.info("Closing {owner}/{name}#{number}".format(**params))
+    github.graphql(
+        CLOSE_PR_MUTATION,
+        input={"pullRequestId": pr_id, "clientMutationId": "A"},
     )
-    pr_id = pr_result["data"]["repository"]["pullRequest"]["id"]
-
-    if close:
-        logging.info("Closing {owner}/{name}#{number}".format(**params))
-        github.graphql(
-            """
-            mutation ($input: ClosePullRequestInput!) {
-                closePullRequest(input: $input) {
-                    clientMutationId
-                }
-            }
-        """,
-            input={"pullRequestId": pr_id, "clientMutationId": "A"},
-        )
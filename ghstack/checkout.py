@@ -1,12 +1,40 @@
 #!/usr/bin/env python3
 
+import json
 import logging
 import re
+import time
 
+import ghstack.cache
 import ghstack.github
 import ghstack.github_utils
 import ghstack.shell
 
+RE_HEAD_SUFFIX = re.compile(r"/head$")
+
+# How long (in seconds) we trust a cached headRefName for.  The head ref
+# of a ghstack PR never changes unless someone renames its branch.
+HEAD_REF_CACHE_TTL = 24 * 60 * 60
+
+
+def get_head_ref(
+    github: ghstack.github.GitHubEndpoint,
+    params: ghstack.github_utils.GitHubPullRequestParams,
+) -> str:
+    key = "{github_url}/{owner}/{name}/{number}".format(**params)
+    if (cached := ghstack.cache.get("github_head_ref", key)) is not None:
+        entry = json.loads(cached)
+        if time.time() - entry["time"] < HEAD_REF_CACHE_TTL:
+            logging.debug("Retrieved head ref from cache")
+            head_ref = entry["head_ref"]
+            assert isinstance(head_ref, str)
+            return head_ref
+    head_ref = github.get_head_ref(**params)
+    ghstack.cache.put(
+        "github_head_ref", key, json.dumps({"time": time.time(), "head_ref": head_ref})
+    )
+    return head_ref
+
 
 def main(
     pull_request: str,
@@ -18,8 +46,8 @@ def main(
     params = ghstack.github_utils.parse_pull_request(
         pull_request, sh=sh, remote_name=remote_name
     )
-    head_ref = github.get_head_ref(**params)
-    orig_ref = re.sub(r"/head$", "/orig", head_ref)
+    head_ref = get_head_ref(github, params)
+    orig_ref = RE_HEAD_SUFFIX.sub("/orig", head_ref)
     if orig_ref == head_ref:
         logging.warning(
             "The ref {} doesn't look like a ghstack reference".format(head_ref)
@@ -27,5 +55,12 @@ def main(
 
     # TODO: Handle remotes correctly too (so this subsumes hub)
 
-    sh.git("fetch", "--prune", remote_name)
-    sh.git("checkout", remote_name + "/" + orig_ref)
+    # NB: only fetch the branch we are going to check out; fetching (and
+    # pruning) everything can be very slow on large remotes
+    remote_orig_ref = remote_name + "/" + orig_ref
+    sh.git(
+        "fetch",
+        remote_name,
+        f"+refs/heads/{orig_ref}:refs/remotes/{remote_orig_ref}",
+    )
+    sh.git("checkout", remote_orig_ref)
@@ -21,6 +21,12 @@ class CircleCIEndpoint(metaclass=ABCMeta):
         """
         return await self.rest("post", path, **kwargs)
 
+    async def close(self) -> None:
+        """
+        Release any resources (e.g., connections) held by the endpoint.
+        """
+        pass
+
     @abstractmethod
     async def rest(self, method: str, path: str, **kwargs: Any) -> Any:
         """
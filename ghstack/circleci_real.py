@@ -10,7 +10,7 @@ import aiohttp
 import ghstack.cache
 import ghstack.circleci
 
-RE_BUILD_PATH = re.compile(r"^project/github/[^/]+/[^/]+/[0-9]+$")
+RE_BUILD_PATH = re.compile(r"project/github/[^/]+/[^/]+/[0-9]+")
 
 
 class RealCircleCIEndpoint(ghstack.circleci.CircleCIEndpoint):
@@ -24,18 +24,35 @@ class RealCircleCIEndpoint(ghstack.circleci.CircleCIEndpoint):
     # Facebook users, this is typically 'http://fwdproxy:8080')
     proxy: Optional[str]
 
+    # Session shared by all of our requests, so that we can reuse
+    # connections across API calls.  Created on first use, as it must be
+    # created from within the event loop it will be used on.
+    _session: Optional[aiohttp.ClientSession]
+
     def __init__(
         self, *, circle_token: Optional[str] = None, proxy: Optional[str] = None
     ):
         self.circle_token = circle_token
         self.proxy = proxy
+        self._session = None
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=30),
+                headers={
+                    "Content-Type": "application/json",
+                    "User-Agent": "ghstack",
+                },
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
 
     async def rest(self, method: str, path: str, **kwargs: Any) -> Any:
-        headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "ghstack",
-        }
-
         url = self.rest_endpoint + "/" + path
         logging.debug("# {} {}".format(method, url))
         logging.debug("Request body:\n{}".format(json.dumps(kwargs, indent=1)))
@@ -44,16 +61,25 @@ class RealCircleCIEndpoint(ghstack.circleci.CircleCIEndpoint):
         if self.circle_token:
             params["circle-token"] = self.circle_token
 
-        is_get_build = method == "get" and RE_BUILD_PATH.match(path)
+        is_get_build = method == "get" and RE_BUILD_PATH.fullmatch(path)
 
+        headers = {}
+        pending_body = None
         if is_get_build:
             # consult cache
             cache_result = ghstack.cache.get("circleci", path)
             if cache_result is not None:
                 logging.debug("Retrieved result from cache")
                 return json.loads(cache_result)
-
-        async with aiohttp.request(
+            # If we've seen this build while it was still running, ask
+            # CircleCI to only send it again if it changed
+            pending_result = ghstack.cache.get("circleci_pending", path)
+            if pending_result is not None:
+                pending = json.loads(pending_result)
+                headers["If-None-Match"] = pending["etag"]
+                pending_body = pending["body"]
+
+        async with self.session().request(
             method.upper(),
             url,
             params=params,
@@ -63,12 +89,20 @@ class RealCircleCIEndpoint(ghstack.circleci.CircleCIEndpoint):
         ) as resp:
             logging.debug("Response status: {}".format(resp.status))
 
-            r_text = await resp.text()
+            if resp.status == 304 and pending_body is not None:
+                logging.debug("Build unchanged, using result from cache")
+                return json.loads(pending_body)
+
+            # NB: json.loads takes bytes directly, so don't bother decoding
+            # the body to a str (which may also involve sniffing its charset)
+            body = await resp.read()
 
             try:
-                r = json.loads(r_text)
+                r = json.loads(body)
             except json.decoder.JSONDecodeError:
-                logging.debug("Response body:\n{}".format(r_text))
+                logging.debug(
+                    "Response body:\n{}".format(body.decode("utf-8", "replace"))
+                )
                 raise
             else:
                 pretty_json = json.dumps(r, indent=1)
@@ -79,9 +113,16 @@ class RealCircleCIEndpoint(ghstack.circleci.CircleCIEndpoint):
             except aiohttp.ClientResponseError:
                 raise RuntimeError(pretty_json)
 
-            # NB: Don't save to cache if it's still running
+            # NB: Don't save to cache if it's still running; but do
+            # remember its ETag, so we can cheaply check if it changed
             if is_get_build and r["outcome"] is not None:
                 logging.debug("Saving result to cache")
-                ghstack.cache.put("circleci", path, r_text)
+                ghstack.cache.put("circleci", path, body.decode())
+            elif is_get_build and (etag := resp.headers.get("ETag")):
+                ghstack.cache.put(
+                    "circleci_pending",
+                    path,
+                    json.dumps({"etag": etag, "body": body.decode()}),
+                )
 
             return r
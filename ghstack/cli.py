@@ -1,28 +1,40 @@
-import asyncio
 import contextlib
-from typing import Generator, List, Optional, Tuple
+from typing import (
+    Any,
+    Callable,
+    Generator,
+    List,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+    TypeVar,
+)
 
 import click
 
 import ghstack
-import ghstack.action
-import ghstack.checkout
-import ghstack.circleci_real
-import ghstack.config
-import ghstack.github_real
-import ghstack.land
-import ghstack.logs
-import ghstack.rage
-import ghstack.status
-import ghstack.submit
-import ghstack.unlink
+import ghstack.github
+
+# NB: the modules implementing each subcommand (as well as config reading
+# and the real GitHub endpoint, which pull in requests) are imported lazily,
+# so that we don't pay for importing all of their dependencies when running
+# some other command.  Every command that talks to GitHub (e.g., submit)
+# still loads requests via cli_context; what this saves them is aiohttp and
+# the status/CircleCI code.  Likewise for logging and the shell, which
+# aren't needed when click is just asked for shell completions (which it
+# answers without running any of our callbacks).
+if TYPE_CHECKING:
+    import ghstack.config
+    import ghstack.shell
 
 EXIT_STACK = contextlib.ExitStack()
 
+F = TypeVar("F", bound=Callable[..., Any])
+
 GhstackContext = Tuple[
-    ghstack.shell.Shell,
-    ghstack.config.Config,
-    ghstack.github_real.RealGitHubEndpoint,
+    "ghstack.shell.Shell",
+    "ghstack.config.Config",
+    ghstack.github.GitHubEndpoint,
 ]
 
 
@@ -32,6 +44,10 @@ def cli_context(
     request_circle_token: bool = False,
     request_github_token: bool = True,
 ) -> Generator[GhstackContext, None, None]:
+    import ghstack.config
+    import ghstack.github_real
+    import ghstack.shell
+
     with EXIT_STACK:
         shell = ghstack.shell.Shell()
         config = ghstack.config.read_config(
@@ -43,25 +59,118 @@ def cli_context(
             proxy=config.proxy,
             github_url=config.github_url,
         )
+        EXIT_STACK.callback(github.close)
         yield shell, config, github
 
 
+def submit_options(*, hidden: bool = False) -> Callable[[F], F]:
+    """
+    Decorator adding the options accepted by submit.  The top-level
+    command accepts them too (hidden from its help), since running ghstack
+    without a subcommand means submit.
+    """
+    options = [
+        click.option(
+            "--message",
+            "-m",
+            default="Update",
+            hidden=hidden,
+            help="Description of change you made",
+        ),
+        click.option(
+            "--update-fields",
+            "-u",
+            is_flag=True,
+            hidden=hidden,
+            help="Update GitHub pull request summary from the local commit",
+        ),
+        click.option(
+            "--short",
+            is_flag=True,
+            hidden=hidden,
+            help="Print only the URL of the latest opened PR to stdout",
+        ),
+        click.option(
+            "--force",
+            is_flag=True,
+            hidden=hidden,
+            help="force push the branch even if your local branch is stale",
+        ),
+        click.option(
+            "--no-skip",
+            is_flag=True,
+            hidden=hidden,
+            help="Never skip pushing commits, even if the contents didn't change "
+            "(use this if you've only updated the commit message).",
+        ),
+        click.option(
+            "--draft",
+            is_flag=True,
+            hidden=hidden,
+            help="Create the pull request in draft mode (only if it has not already been created)",
+        ),
+        click.option(
+            "--base",
+            "-B",
+            default=None,
+            hidden=hidden,
+            help="Branch to base the stack off of; "
+            "defaults to the default branch of a repository",
+        ),
+        click.option(
+            "--stack/--no-stack",
+            "-s/-S",
+            is_flag=True,
+            default=True,
+            hidden=hidden,
+            help="Submit the entire of stack of commits reachable from HEAD, versus only single commits.  "
+            "This affects the meaning of REVS.  With --stack, we submit all commits that "
+            "are reachable from REVS, excluding commits already on the base branch.  Revision ranges "
+            "supported by git rev-list are also supported.  "
+            "With --no-stack, we support only non-range identifiers, and will submit each commit "
+            "listed in the command line.",
+        ),
+        click.option(
+            "--direct/--no-direct",
+            "direct_opt",
+            default=None,
+            is_flag=True,
+            hidden=hidden,
+            help="Create stack that directly merges into master",
+        ),
+        click.option(
+            "--fetch-max-age",
+            type=float,
+            default=None,
+            metavar="SECONDS",
+            hidden=hidden,
+            help="Don't fetch from the remote if ghstack already fetched it less than "
+            "SECONDS ago.  Handy when iterating quickly on a stack in a large repository.",
+        ),
+        click.option(
+            "--no-fetch",
+            is_flag=True,
+            hidden=hidden,
+            help="Don't fetch from the remote at all, and use the remote branches "
+            "you already have.  If they are stale, submit may refuse to push.",
+        ),
+    ]
+
+    def decorator(f: F) -> F:
+        # NB: apply in reverse, so the options are listed in the order above
+        for option in reversed(options):
+            f = option(f)
+        return f
+
+    return decorator
+
+
 @click.group(invoke_without_command=True)
 @click.pass_context
-@click.version_option(ghstack.__version__, "--version", "-V")
+@click.version_option(None, "--version", "-V", package_name="ghstack")
 @click.option("--debug", is_flag=True, help="Log debug information to stderr")
 # hidden arguments that we'll pass along to submit if no other command given
-@click.option("--message", "-m", default="Update", hidden=True)
-@click.option("--update-fields", "-u", is_flag=True, hidden=True)
-@click.option("--short", is_flag=True, hidden=True)
-@click.option("--force", is_flag=True, hidden=True)
-@click.option("--no-skip", is_flag=True, hidden=True)
-@click.option("--draft", is_flag=True, hidden=True)
-@click.option(
-    "--direct/--no-direct", "direct_opt", is_flag=True, hidden=True, default=None
-)
-@click.option("--base", "-B", default=None, hidden=True)
-@click.option("--stack/--no-stack", "-s/-S", is_flag=True, default=True, hidden=True)
+@submit_options(hidden=True)
 def main(
     ctx: click.Context,
     debug: bool,
@@ -74,10 +183,14 @@ def main(
     draft: bool,
     base: Optional[str],
     stack: bool,
+    fetch_max_age: Optional[float],
+    no_fetch: bool,
 ) -> None:
     """
     Submit stacks of diffs to Github
     """
+    import ghstack.logs
+
     EXIT_STACK.enter_context(ghstack.logs.manager(debug=debug))
 
     if not ctx.invoked_subcommand:
@@ -92,6 +205,8 @@ def main(
             base=base,
             stack=stack,
             direct_opt=direct_opt,
+            fetch_max_age=fetch_max_age,
+            no_fetch=no_fetch,
         )
 
 
@@ -102,6 +217,8 @@ def action(close: bool, pull_request: str) -> None:
     """
     Perform actions on a PR
     """
+    import ghstack.action
+
     with cli_context() as (shell, _, github):
         ghstack.action.main(
             pull_request=pull_request,
@@ -117,6 +234,8 @@ def checkout(pull_request: str) -> None:
     """
     Checkout a PR
     """
+    import ghstack.checkout
+
     with cli_context(request_github_token=False) as (shell, config, github):
         ghstack.checkout.main(
             pull_request=pull_request,
@@ -133,6 +252,8 @@ def land(force: bool, pull_request: str) -> None:
     """
     Land a PR stack
     """
+    import ghstack.land
+
     with cli_context() as (shell, config, github):
         ghstack.land.main(
             pull_request=pull_request,
@@ -151,7 +272,11 @@ def land(force: bool, pull_request: str) -> None:
     help="Select the last command (not including rage commands) to report",
 )
 def rage(latest: bool) -> None:
-    with cli_context(request_github_token=False):
+    import ghstack.rage
+
+    # NB: rage only looks at our logs, so don't bother reading the config
+    # (which may prompt!) or setting up a GitHub endpoint
+    with EXIT_STACK:
         ghstack.rage.main(latest)
 
 
@@ -161,79 +286,31 @@ def status(pull_request: str) -> None:
     """
     Check status of a PR
     """
+    import asyncio
+
+    import ghstack.circleci_real
+    import ghstack.status
+
     with cli_context(request_circle_token=True) as (shell, config, github):
         circleci = ghstack.circleci_real.RealCircleCIEndpoint(
             circle_token=config.circle_token
         )
 
-        fut = ghstack.status.main(
-            pull_request=pull_request,
-            github=github,
-            circleci=circleci,
-        )
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(fut)
-        loop.close()
+        async def run() -> None:
+            try:
+                await ghstack.status.main(
+                    pull_request=pull_request,
+                    github=github,
+                    circleci=circleci,
+                )
+            finally:
+                await circleci.close()
+
+        asyncio.run(run())
 
 
 @main.command("submit")
-@click.option(
-    "--message",
-    "-m",
-    default="Update",
-    help="Description of change you made",
-)
-@click.option(
-    "--update-fields",
-    "-u",
-    is_flag=True,
-    help="Update GitHub pull request summary from the local commit",
-)
-@click.option(
-    "--short", is_flag=True, help="Print only the URL of the latest opened PR to stdout"
-)
-@click.option(
-    "--force",
-    is_flag=True,
-    help="force push the branch even if your local branch is stale",
-)
-@click.option(
-    "--no-skip",
-    is_flag=True,
-    help="Never skip pushing commits, even if the contents didn't change "
-    "(use this if you've only updated the commit message).",
-)
-@click.option(
-    "--draft",
-    is_flag=True,
-    help="Create the pull request in draft mode (only if it has not already been created)",
-)
-@click.option(
-    "--base",
-    "-B",
-    default=None,
-    help="Branch to base the stack off of; "
-    "defaults to the default branch of a repository",
-)
-@click.option(
-    "--stack/--no-stack",
-    "-s/-S",
-    is_flag=True,
-    default=True,
-    help="Submit the entire of stack of commits reachable from HEAD, versus only single commits.  "
-    "This affects the meaning of REVS.  With --stack, we submit all commits that "
-    "are reachable from REVS, excluding commits already on the base branch.  Revision ranges "
-    "supported by git rev-list are also supported.  "
-    "With --no-stack, we support only non-range identifiers, and will submit each commit "
-    "listed in the command line.",
-)
-@click.option(
-    "--direct/--no-direct",
-    "direct_opt",
-    default=None,
-    is_flag=True,
-    help="Create stack that directly merges into master",
-)
+@submit_options()
 @click.argument(
     "revs",
     nargs=-1,
@@ -250,10 +327,14 @@ def submit(
     base: Optional[str],
     revs: Tuple[str, ...],
     stack: bool,
+    fetch_max_age: Optional[float],
+    no_fetch: bool,
 ) -> None:
     """
     Submit or update a PR stack
     """
+    import ghstack.submit
+
     with cli_context() as (shell, config, github):
         ghstack.submit.main(
             msg=message,
@@ -271,6 +352,8 @@ def submit(
             revs=revs,
             stack=stack,
             direct_opt=direct_opt,
+            fetch_max_age=fetch_max_age,
+            no_fetch=no_fetch,
         )
 
 
@@ -280,6 +363,8 @@ def unlink(commits: List[str]) -> None:
     """
     Unlink commits from PRs
     """
+    import ghstack.unlink
+
     with cli_context() as (shell, config, github):
         ghstack.unlink.main(
             commits=commits,
@@ -1,47 +1,52 @@
 #!/usr/bin/env python3
 
 import configparser
+import functools
 import getpass
 import logging
 import os
 import re
+import shutil
+import tempfile
 from pathlib import Path
-from typing import NamedTuple, Optional
-
-import requests
+from typing import Dict, NamedTuple, Optional, Tuple
 
 import ghstack.logs
 
-DEFAULT_GHSTACKRC_PATH = Path.home() / ".ghstackrc"
+HOME = Path.home()
+DEFAULT_GHSTACKRC_PATH = HOME / ".ghstackrc"
+DEFAULT_FBSOURCE_PATH = str(HOME / "local" / "fbsource")
+DEFAULT_GITHUB_PATH = str(HOME / "local" / "ghstack-pytorch")
 GHSTACKRC_PATH_VAR = "GHSTACKRC_PATH"
 
-Config = NamedTuple(
-    "Config",
-    [
-        # Proxy to use when making connections to GitHub
-        ("proxy", Optional[str]),
-        # OAuth token to authenticate to GitHub with
-        ("github_oauth", Optional[str]),
-        # GitHub username; used to namespace branches we create
-        ("github_username", str),
-        # Token to authenticate to CircleCI with
-        ("circle_token", Optional[str]),
-        # These config parameters are not used by ghstack, but other
-        # tools that reuse this module
-        # Path to working fbsource checkout
-        ("fbsource_path", str),
-        # Path to working git checkout (ghstack infers your git checkout
-        # based on CWD)
-        ("github_path", str),
-        # Path to project directory inside fbsource, to default when
-        # autodetection fails
-        ("default_project_dir", str),
-        # GitHub url. Defaults to github.com which is true for all non-enterprise github repos
-        ("github_url", str),
-        # Name of the upstream remote
-        ("remote_name", str),
-    ],
-)
+RE_DOMAIN = re.compile(r"[\w\.-]+\.\w+$")
+
+RE_GITHUB_USERNAME = re.compile(r"^[a-z\d](?:[a-z\d]|-(?=[a-z\d])){0,38}$", re.I)
+
+
+class Config(NamedTuple):
+    # Proxy to use when making connections to GitHub
+    proxy: Optional[str]
+    # OAuth token to authenticate to GitHub with
+    github_oauth: Optional[str]
+    # GitHub username; used to namespace branches we create
+    github_username: str
+    # Token to authenticate to CircleCI with
+    circle_token: Optional[str]
+    # These config parameters are not used by ghstack, but other
+    # tools that reuse this module
+    # Path to working fbsource checkout
+    fbsource_path: str
+    # Path to working git checkout (ghstack infers your git checkout
+    # based on CWD)
+    github_path: str
+    # Path to project directory inside fbsource, to default when
+    # autodetection fails
+    default_project_dir: str
+    # GitHub url. Defaults to github.com which is true for all non-enterprise github repos
+    github_url: str
+    # Name of the upstream remote
+    remote_name: str
 
 
 def get_path_from_env_var(var_name: str) -> Optional[Path]:
@@ -50,6 +55,68 @@ def get_path_from_env_var(var_name: str) -> Optional[Path]:
     return None
 
 
+@functools.lru_cache()
+def find_config_path(cwd: str) -> Optional[str]:
+    """
+    Find the closest .ghstackrc in cwd or one of its parent directories,
+    if any.  Memoized, as this stats a file for every directory level.
+    """
+    current_dir = Path(cwd)
+    while current_dir != current_dir.parent:
+        tentative_config_path = "/".join([str(current_dir), ".ghstackrc"])
+        if os.path.exists(tentative_config_path):
+            return tentative_config_path
+        current_dir = current_dir.parent
+    return None
+
+
+def write_config(config: configparser.ConfigParser, config_path: str) -> None:
+    """
+    Write config to config_path atomically: we write to a temporary file
+    and rename it into place, so that we never leave behind a half written
+    config if we crash.  If config_path is a symlink (e.g., into a dotfiles
+    repo), we write to the file it points to, and we preserve the
+    permissions of the existing file.
+    """
+    real_path = os.path.realpath(config_path)
+    f = tempfile.NamedTemporaryFile("w", dir=os.path.dirname(real_path), delete=False)
+    try:
+        with f:
+            config.write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        # NB: if there's no existing config, we leave the temporary file's
+        # permissions (only readable by you), as it may hold a token
+        if os.path.exists(real_path):
+            shutil.copymode(real_path, f.name)
+        os.replace(f.name, real_path)
+    except BaseException:
+        # Don't leave a (possibly half written) copy of the token behind
+        os.unlink(f.name)
+        raise
+
+
+# Configs we have already read in this process, keyed on everything that
+# read_config depends on (see _config_cache_key)
+_CONFIG_CACHE: Dict[Tuple[object, ...], Config] = {}
+
+
+def _config_cache_key(
+    config_path: str, request_circle_token: bool, request_github_token: bool
+) -> Optional[Tuple[object, ...]]:
+    try:
+        mtime = os.stat(config_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return (
+        config_path,
+        mtime,
+        os.getenv("OAUTH_TOKEN"),
+        request_circle_token,
+        request_github_token,
+    )
+
+
 def read_config(
     *,
     request_circle_token: bool = False,
@@ -57,37 +124,41 @@ def read_config(
 ) -> Config:  # noqa: C901
     config = configparser.ConfigParser()
 
-    config_path = None
-    current_dir = Path(os.getcwd())
-
-    while current_dir != current_dir.parent:
-        tentative_config_path = "/".join([str(current_dir), ".ghstackrc"])
-        if os.path.exists(tentative_config_path):
-            config_path = tentative_config_path
-            break
-        current_dir = current_dir.parent
+    config_path = find_config_path(os.getcwd())
 
     write_back = False
     if config_path is None:
         config_path = str(
             get_path_from_env_var(GHSTACKRC_PATH_VAR) or DEFAULT_GHSTACKRC_PATH
         )
-        write_back = True
 
     logging.debug(f"config_path = {config_path}")
-    config.read([".ghstackrc", config_path])
+
+    cache_key = _config_cache_key(
+        config_path, request_circle_token, request_github_token
+    )
+    if cache_key is not None and (conf := _CONFIG_CACHE.get(cache_key)):
+        return conf
+    # NB: a .ghstackrc in the cwd, if there is one, is what
+    # find_config_path found, so there's no need to read it separately
+    config.read(config_path)
 
     if not config.has_section("ghstack"):
         config.add_section("ghstack")
         write_back = True
 
-    if config.has_option("ghstack", "github_url"):
-        github_url = config.get("ghstack", "github_url")
+    # NB: snapshot the section, rather than going through the (slow)
+    # ConfigParser accessors for every option; we only go back to config
+    # when we need to write something back
+    opts = dict(config.items("ghstack"))
+
+    if "github_url" in opts:
+        github_url = opts["github_url"]
     else:
         github_url = input("GitHub enterprise domain (leave blank for OSS GitHub): ")
         if not github_url:
             github_url = "github.com"
-        if not re.match(r"[\w\.-]+\.\w+$", github_url):
+        if not RE_DOMAIN.match(github_url):
             raise RuntimeError(
                 f"{github_url} is not a valid domain name (do not include http:// scheme)"
             )
@@ -103,9 +174,11 @@ def read_config(
             "this is probably not what you intended; unset OAUTH_TOKEN from your "
             "environment to use the setting in .ghstackrc instead."
         )
-    if github_oauth is None and config.has_option("ghstack", "github_oauth"):
-        github_oauth = config.get("ghstack", "github_oauth")
+    if github_oauth is None:
+        github_oauth = opts.get("github_oauth")
     if github_oauth is None and request_github_token:
+        import requests
+
         print("Generating GitHub access token...")
         CLIENT_ID = "89cc88ca50efbe86907a"
         res = requests.post(
@@ -132,11 +205,9 @@ def read_config(
         config.set("ghstack", "github_oauth", github_oauth)
         write_back = True
     if github_oauth is not None:
-        ghstack.logs.formatter.redact(github_oauth, "<GITHUB_OAUTH>")
+        ghstack.logs.redaction_filter.redact(github_oauth, "<GITHUB_OAUTH>")
 
-    circle_token = None
-    if circle_token is None and config.has_option("ghstack", "circle_token"):
-        circle_token = config.get("ghstack", "circle_token")
+    circle_token = opts.get("circle_token")
     if circle_token is None and request_circle_token:
         circle_token = getpass.getpass(
             "CircleCI Personal API token (make one at "
@@ -145,12 +216,12 @@ def read_config(
         config.set("ghstack", "circle_token", circle_token)
         write_back = True
     if circle_token is not None:
-        ghstack.logs.formatter.redact(circle_token, "<CIRCLE_TOKEN>")
+        ghstack.logs.redaction_filter.redact(circle_token, "<CIRCLE_TOKEN>")
 
-    github_username = None
-    if config.has_option("ghstack", "github_username"):
-        github_username = config.get("ghstack", "github_username")
+    github_username = opts.get("github_username")
     if github_username is None and github_oauth is not None:
+        import requests
+
         request_url: str
         if github_url == "github.com":
             request_url = f"https://api.{github_url}/user"
@@ -170,42 +241,21 @@ def read_config(
         write_back = True
     if github_username is None:
         github_username = input("GitHub username: ")
-        if not re.match(
-            r"^[a-z\d](?:[a-z\d]|-(?=[a-z\d])){0,38}$", github_username, re.I
-        ):
+        if not RE_GITHUB_USERNAME.match(github_username):
             raise RuntimeError(
                 "{} is not a valid GitHub username".format(github_username)
             )
         config.set("ghstack", "github_username", github_username)
         write_back = True
 
-    proxy = None
-    if config.has_option("ghstack", "proxy"):
-        proxy = config.get("ghstack", "proxy")
-
-    if config.has_option("ghstack", "fbsource_path"):
-        fbsource_path = config.get("ghstack", "fbsource_path")
-    else:
-        fbsource_path = os.path.expanduser("~/local/fbsource")
-
-    if config.has_option("ghstack", "github_path"):
-        github_path = config.get("ghstack", "github_path")
-    else:
-        github_path = os.path.expanduser("~/local/ghstack-pytorch")
-
-    if config.has_option("ghstack", "default_project"):
-        default_project_dir = config.get("ghstack", "default_project_dir")
-    else:
-        default_project_dir = "fbcode/caffe2"
-
-    if config.has_option("ghstack", "remote_name"):
-        remote_name = config.get("ghstack", "remote_name")
-    else:
-        remote_name = "origin"
+    proxy = opts.get("proxy")
+    fbsource_path = opts.get("fbsource_path", DEFAULT_FBSOURCE_PATH)
+    github_path = opts.get("github_path", DEFAULT_GITHUB_PATH)
+    default_project_dir = opts.get("default_project_dir", "fbcode/caffe2")
+    remote_name = opts.get("remote_name", "origin")
 
     if write_back:
-        with open(config_path, "w") as f:
-            config.write(f)
+        write_config(config, config_path)
         logging.info("NB: configuration saved to {}".format(config_path))
 
     conf = Config(
@@ -220,4 +270,10 @@ def read_config(
         remote_name=remote_name,
     )
     logging.debug(f"conf = {conf}")
+    if write_back:
+        cache_key = _config_cache_key(
+            config_path, request_circle_token, request_github_token
+        )
+    if cache_key is not None:
+        _CONFIG_CACHE[cache_key] = conf
     return conf
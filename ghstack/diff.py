@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import functools
 import re
 from dataclasses import dataclass
 from typing import Optional, Pattern
@@ -19,10 +20,12 @@ RAW_PULL_REQUEST_RESOLVED = (
 )
 
 
+@functools.lru_cache()
 def re_pull_request_resolved(github_url: str) -> Pattern[str]:
     return re.compile(RAW_PULL_REQUEST_RESOLVED.format(github_url=github_url))
 
 
+@functools.lru_cache()
 def re_pull_request_resolved_w_sp(github_url: str) -> Pattern[str]:
     return re.compile(r"\n*" + RAW_PULL_REQUEST_RESOLVED.format(github_url=github_url))
 
@@ -41,23 +44,24 @@ class PullRequestResolved:
 
     @staticmethod
     def search(s: str, github_url: str) -> Optional["PullRequestResolved"]:
-        m = re_pull_request_resolved(github_url).search(s)
-        if m is not None:
-            return PullRequestResolved(
-                owner=m.group("owner"),
-                repo=m.group("repo"),
-                number=GitHubNumber(int(m.group("number"))),
-                github_url=github_url,
-            )
-        m = RE_GH_METADATA.search(s)
-        if m is not None:
-            return PullRequestResolved(
-                owner=m.group("owner"),
-                repo=m.group("repo"),
-                number=GitHubNumber(int(m.group("number"))),
-                github_url=github_url,
-            )
-        return None
+        # NB: most commits have neither trailer, so rule them out with a
+        # (much cheaper) substring search before running the regexes
+        m = None
+        if "Pull Request resolved: " in s:
+            m = re_pull_request_resolved(github_url).search(s)
+        if m is None and "gh-metadata: " in s:
+            m = RE_GH_METADATA.search(s)
+        if m is None:
+            return None
+        # NB: both regexes start with the owner, repo and number groups,
+        # so we can unpack those positionally
+        owner, repo, number = m.groups()[:3]
+        return PullRequestResolved(
+            owner=owner,
+            repo=repo,
+            number=GitHubNumber(int(number)),
+            github_url=github_url,
+        )
 
 
 @dataclass
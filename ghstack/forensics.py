@@ -4,30 +4,27 @@
 # This script looks at all commits downloads their logs and prints them
 # for you
 
+import asyncio
+import json
 import re
 from typing import Any, Dict
 
-import aiohttp
-
 import ghstack.circleci
 import ghstack.github
 import ghstack.github_utils
+import ghstack.status
 
 RE_CIRCLECI_URL = re.compile(r"^https://circleci.com/gh/pytorch/pytorch/([0-9]+)")
 
 
-def strip_sccache(x: str) -> str:
-    sccache_marker = "=================== sccache compilation log ==================="
-    marker_pos = x.rfind(sccache_marker)
-    newline_before_marker_pos = x.rfind("\n", 0, marker_pos)
-    return x[:newline_before_marker_pos]
-
-
 async def main(
     pull_request: str,
     github: ghstack.github.GitHubEndpoint,
     circleci: ghstack.circleci.CircleCIEndpoint,
 ) -> None:
+    # NB: imported here, so that importing this module doesn't pull
+    # in aiohttp
+    import aiohttp
 
     # Game plan:
     # 1. Query GitHub to find out what the current statuses are
@@ -112,18 +109,27 @@ async def main(
                 icon = "❔"
                 break
             icon = "❌"
-            async with aiohttp.request(
-                "get", r["steps"][-1]["actions"][-1]["output_url"]
+            async with log_session.get(
+                r["steps"][-1]["actions"][-1]["output_url"]
             ) as resp:
-                log_json = await resp.json()
-                buf = []
-                for e in log_json:
-                    buf.append(e["message"])
-                text = "\n" + strip_sccache("\n".join(buf))
-                text = text[-1500:]
+                # NB: json.loads takes bytes directly, so skip decoding the
+                # (potentially enormous) body to a str
+                log_json = json.loads(await resp.read())
+                text = ghstack.status.log_tail([e["message"] for e in log_json])
         return "{} {} {}{}{}".format(
             icon, commit["oid"][:8], commit["messageHeadline"], buildid_text, text
         )
 
-    for n in nodes:
-        print(await process_node(n))
+    # Process all of the commits concurrently, but don't have too many
+    # requests to CircleCI in flight at once, so we don't get rate limited
+    semaphore = asyncio.Semaphore(ghstack.status.MAX_CONCURRENT_REQUESTS)
+
+    async def process_node_limited(n: Dict[str, Any]) -> str:
+        async with semaphore:
+            return await process_node(n)
+
+    # NB: the session is closed before we leave the event loop
+    async with aiohttp.ClientSession() as log_session:
+        results = await asyncio.gather(*map(process_node_limited, nodes))
+    for result in results:
+        print(result)
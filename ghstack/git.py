@@ -1,20 +1,61 @@
 #!/usr/bin/env python3
 
-import re
-from functools import cached_property
-from typing import List, Pattern
+from typing import Iterator, List, NamedTuple
 
 import ghstack.diff
 import ghstack.shell
 from ghstack.types import GitCommitHash, GitTreeHash
 
-RE_RAW_COMMIT_ID = re.compile(r"^(?P<boundary>-?)(?P<commit>[a-f0-9]+)$", re.MULTILINE)
-RE_RAW_AUTHOR = re.compile(
-    r"^author (?P<author>(?P<name>[^<]+?) <(?P<email>[^>]+)>)", re.MULTILINE
-)
-RE_RAW_PARENT = re.compile(r"^parent (?P<commit>[a-f0-9]+)$", re.MULTILINE)
-RE_RAW_TREE = re.compile(r"^tree (?P<tree>.+)$", re.MULTILINE)
-RE_RAW_COMMIT_MSG_LINE = re.compile(r"^    (?P<line>.*)$", re.MULTILINE)
+
+class RawCommit(NamedTuple):
+    commit_id: GitCommitHash
+    boundary: bool
+    tree: GitTreeHash
+    parents: List[GitCommitHash]
+    author_name: str
+    author_email: str
+    commit_msg: str
+
+
+def _parse_raw_commit(raw_header: str) -> RawCommit:
+    """
+    Parse a single record of `git rev-list --header` output in one pass.
+    The record consists of the commit id (prefixed with '-' if it is a
+    boundary commit), the raw commit headers, a blank line, and then the
+    commit message with every line indented by four spaces.
+    """
+    header, _, body = raw_header.partition("\n\n")
+    lines = header.split("\n")
+    commit_line = lines[0]
+    boundary = commit_line.startswith("-")
+    tree = None
+    parents = []
+    author_name = None
+    author_email = None
+    for line in lines[1:]:
+        if line.startswith("tree "):
+            tree = line[5:]
+        elif line.startswith("parent "):
+            parents.append(GitCommitHash(line[7:]))
+        elif line.startswith("author "):
+            author_name, _, rest = line[7:].partition(" <")
+            author_email = rest.partition(">")[0]
+    assert tree is not None
+    assert author_name is not None and author_email is not None
+    # NB: git indents every line of the message (blank ones included) by
+    # four spaces, so we can dedent it in one go
+    commit_msg = body[4:].replace("\n    ", "\n")
+    if commit_msg.endswith("\n"):
+        commit_msg = commit_msg[:-1]
+    return RawCommit(
+        commit_id=GitCommitHash(commit_line[1:] if boundary else commit_line),
+        boundary=boundary,
+        tree=GitTreeHash(tree),
+        parents=parents,
+        author_name=author_name,
+        author_email=author_email,
+        commit_msg=commit_msg,
+    )
 
 
 class CommitHeader(object):
@@ -22,61 +63,82 @@ class CommitHeader(object):
     Represents the information extracted from `git rev-list --header`
     """
 
+    __slots__ = (
+        "raw_header",
+        "commit_id",
+        "boundary",
+        "tree",
+        "parents",
+        "author_name",
+        "author_email",
+        "commit_msg",
+        "title",
+    )
+
     # The unparsed output from git rev-list --header
     raw_header: str
 
+    commit_id: GitCommitHash
+    boundary: bool
+    tree: GitTreeHash
+    parents: List[GitCommitHash]
+    author_name: str
+    author_email: str
+    commit_msg: str
+    title: str
+
     def __init__(self, raw_header: str):
+        # NB: we always end up looking at most of the fields, so just
+        # parse everything up front
         self.raw_header = raw_header
+        (
+            self.commit_id,
+            self.boundary,
+            self.tree,
+            self.parents,
+            self.author_name,
+            self.author_email,
+            self.commit_msg,
+        ) = _parse_raw_commit(raw_header)
+        self.title = self.commit_msg.split("\n", 1)[0]
+
+    @property
+    def author(self) -> str:
+        return "{} <{}>".format(self.author_name, self.author_email)
 
-    def _search_group(self, regex: Pattern[str], group: str) -> str:
-        m = regex.search(self.raw_header)
-        assert m
-        return m.group(group)
-
-    @cached_property
-    def tree(self) -> GitTreeHash:
-        return GitTreeHash(self._search_group(RE_RAW_TREE, "tree"))
-
-    @cached_property
-    def title(self) -> str:
-        return self._search_group(RE_RAW_COMMIT_MSG_LINE, "line")
-
-    @cached_property
-    def commit_id(self) -> GitCommitHash:
-        return GitCommitHash(self._search_group(RE_RAW_COMMIT_ID, "commit"))
-
-    @cached_property
-    def boundary(self) -> bool:
-        return self._search_group(RE_RAW_COMMIT_ID, "boundary") == "-"
 
-    @cached_property
-    def parents(self) -> List[GitCommitHash]:
-        return [
-            GitCommitHash(m.group("commit"))
-            for m in RE_RAW_PARENT.finditer(self.raw_header)
-        ]
+def iter_headers(s: str) -> Iterator[CommitHeader]:
+    """
+    Lazily parse the output of `git rev-list --header`, one commit at a
+    time.
+    """
+    # NB: every record is terminated by a NUL, so the last element of the
+    # split is always empty; skip it rather than slicing a copy of the list
+    return (CommitHeader(h) for h in s.split("\0") if h)
 
-    @cached_property
-    def author(self) -> str:
-        return self._search_group(RE_RAW_AUTHOR, "author")
 
-    @cached_property
-    def author_name(self) -> str:
-        return self._search_group(RE_RAW_AUTHOR, "name")
+def split_header(s: str) -> List[CommitHeader]:
+    return list(iter_headers(s))
 
-    @cached_property
-    def author_email(self) -> str:
-        return self._search_group(RE_RAW_AUTHOR, "email")
 
-    @cached_property
-    def commit_msg(self) -> str:
-        return "\n".join(
-            m.group("line") for m in RE_RAW_COMMIT_MSG_LINE.finditer(self.raw_header)
-        )
+def rev_list(sh: ghstack.shell.Shell, *args: str) -> List[CommitHeader]:
+    """
+    Run `git rev-list --header` with the given arguments, parsing each
+    commit as it comes off the pipe rather than buffering the entire
+    output first.  The whole list is read eagerly, so a git failure is
+    raised here and not wherever the result happens to be consumed.
+    """
+    return [CommitHeader(r) for r in sh.git_popen("rev-list", "--header", *args)]
 
 
-def split_header(s: str) -> List[CommitHeader]:
-    return list(map(CommitHeader, s.split("\0")[:-1]))
+def rev_parse(sh: ghstack.shell.Shell, *revs: str) -> List[GitCommitHash]:
+    """
+    Resolve several revisions with a single rev-parse, rather than spawning
+    git once per revision.
+    """
+    if not revs:
+        return []
+    return [GitCommitHash(r) for r in sh.git("rev-parse", *revs).split("\n")]
 
 
 def convert_header(h: CommitHeader, github_url: str) -> ghstack.diff.Diff:
@@ -86,7 +148,7 @@ def convert_header(h: CommitHeader, github_url: str) -> ghstack.diff.Diff:
         oid=h.commit_id,
         source_id=h.tree,
         pull_request_resolved=ghstack.diff.PullRequestResolved.search(
-            h.raw_header, github_url
+            h.commit_msg, github_url
         ),
         tree=h.tree,
         author_name=h.author_name,
@@ -96,4 +158,4 @@ def convert_header(h: CommitHeader, github_url: str) -> ghstack.diff.Diff:
 
 
 def parse_header(s: str, github_url: str) -> List[ghstack.diff.Diff]:
-    return [convert_header(h, github_url) for h in split_header(s)]
+    return [convert_header(h, github_url) for h in iter_headers(s)]
@@ -1,15 +1,42 @@
 #!/usr/bin/env python3
 
+import re
 from abc import ABCMeta, abstractmethod
-from typing import Any, Sequence
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple
 
 import ghstack.diff
 
+HEAD_REF_QUERY = """
+    query ($owner: String!, $name: String!, $number: Int!) {
+        repository(name: $name, owner: $owner) {
+            pullRequest(number: $number) {
+                headRefName
+            }
+        }
+    }
+"""
+
+
+RE_GRAPHQL_VARIABLE = re.compile(r"\$(\w+)")
+
 
 class NotFoundError(RuntimeError):
     pass
 
 
+class GraphQLRead(NamedTuple):
+    """
+    A single read to be issued as part of GitHubEndpoint.batch_graphql
+    """
+
+    # Field to select at the root of the query, e.g.,
+    # 'repository(owner: $owner, name: $name) { id }'
+    selection: str
+    # The variables used by the selection, mapping each name to its
+    # GraphQL type and value, e.g., {"owner": ("String!", "ezyang")}
+    variables: Dict[str, Tuple[str, Any]]
+
+
 class GitHubEndpoint(metaclass=ABCMeta):
     @abstractmethod
     def graphql(self, query: str, **kwargs: Any) -> Any:
@@ -22,28 +49,54 @@ class GitHubEndpoint(metaclass=ABCMeta):
         """
         pass
 
+    def batch_graphql(self, reads: Sequence[GraphQLRead]) -> List[Any]:
+        """
+        Issue several independent reads as a single GraphQL query, saving
+        a round trip per read.  Each read is selected under its own alias
+        (with its variables renamed to match), and the result for each
+        read is returned in order.
+
+        Only reads can be batched this way; mutations are sensitive to
+        the order they run in, and always get a request of their own.
+        """
+        if not reads:
+            return []
+        decls = []
+        selections = []
+        variables = {}
+        for i, read in enumerate(reads):
+            alias = "r{}".format(i)
+            selection = RE_GRAPHQL_VARIABLE.sub(
+                lambda m: "${}_{}".format(alias, m.group(1)), read.selection
+            )
+            selections.append("{}: {}".format(alias, selection))
+            for name, (type_, value) in read.variables.items():
+                decls.append("${}_{}: {}".format(alias, name, type_))
+                variables["{}_{}".format(alias, name)] = value
+        query = "query {}{{\n{}\n}}".format(
+            "({}) ".format(", ".join(decls)) if decls else "",
+            "\n".join(selections),
+        )
+        data = self.graphql(query, **variables)["data"]
+        return [data["r{}".format(i)] for i in range(len(reads))]
+
     def get_head_ref(self, **params: Any) -> str:
         """
         Fetch the headRefName associated with a PR.  Defaults to a
         GraphQL query but if we're hitting a real GitHub endpoint
         we'll do a regular HTTP request to avoid rate limit.
         """
-        pr_result = self.graphql(
-            """
-            query ($owner: String!, $name: String!, $number: Int!) {
-                repository(name: $name, owner: $owner) {
-                    pullRequest(number: $number) {
-                        headRefName
-                    }
-                }
-            }
-        """,
-            **params
-        )
+        pr_result = self.graphql(HEAD_REF_QUERY, **params)
         r = pr_result["data"]["repository"]["pullRequest"]["headRefName"]
         assert isinstance(r, str), type(r)
         return r
 
+    def close(self) -> None:
+        """
+        Release any resources (e.g., connections) held by the endpoint.
+        """
+        pass
+
     # This hook function should be invoked when a 'git push' to GitHub
     # occurs.  This is used by testing to simulate actions GitHub
     # takes upon branch push, more conveniently than setting up
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
+import functools
+import itertools
 import os.path
 import re
 from dataclasses import dataclass
-from typing import Any, cast, Dict, List, NewType, Optional, Sequence
+from typing import Any, cast, Dict, Iterator, List, NewType, Optional, Sequence, Tuple
 
 import graphql
 from typing_extensions import TypedDict
@@ -12,6 +14,15 @@ import ghstack.diff
 import ghstack.github
 import ghstack.shell
 
+# REST endpoints we implement
+RE_BRANCH_PROTECTION_PATH = re.compile(
+    r"^repos/([^/]+)/([^/]+)/branches/([^/]+)/protection"
+)
+RE_PULLS_PATH = re.compile(r"^repos/([^/]+)/([^/]+)/pulls$")
+RE_ISSUE_COMMENTS_PATH = re.compile(r"^repos/([^/]+)/([^/]+)/issues/([^/]+)/comments")
+RE_REPO_OR_PULL_PATH = re.compile(r"^repos/([^/]+)/([^/]+)(?:/pulls/([^/]+))?$")
+RE_ISSUE_COMMENT_PATH = re.compile(r"^repos/([^/]+)/([^/]+)/issues/comments/([^/]+)$")
+
 GraphQLId = NewType("GraphQLId", str)
 GitHubNumber = NewType("GitHubNumber", int)
 GitObjectID = NewType("GitObjectID", str)
@@ -74,30 +85,34 @@ CreatePullRequestPayload = TypedDict(
 class GitHubState:
     repositories: Dict[GraphQLId, "Repository"]
     pull_requests: Dict[GraphQLId, "PullRequest"]
+    # Indexes on the above, so we don't have to scan them for lookups;
+    # use add_repository/add_pull_request to keep them in sync
+    _repositories_by_name: Dict[str, "Repository"]
+    _pull_requests_by_number: Dict[Tuple[GraphQLId, GitHubNumber], "PullRequest"]
+    _pull_requests_by_repository: Dict[GraphQLId, List["PullRequest"]]
     # This is very inefficient but whatever
     issue_comments: Dict[GraphQLId, "IssueComment"]
-    _next_id: int
+    _next_id: Iterator[int]
     # These are indexed by repo id
-    _next_pull_request_number: Dict[GraphQLId, int]
-    _next_issue_comment_full_database_id: Dict[GraphQLId, int]
+    _next_pull_request_number: Dict[GraphQLId, Iterator[int]]
+    _next_issue_comment_full_database_id: Dict[GraphQLId, Iterator[int]]
     root: "Root"
     upstream_sh: Optional[ghstack.shell.Shell]
+    # Git objects we've made, indexed by repo id and oid, so refs that
+    # point to the same commit can share them
+    _objects: Dict[Tuple[GraphQLId, GitObjectID], "GitObject"]
 
     def repository(self, owner: str, name: str) -> "Repository":
-        nameWithOwner = "{}/{}".format(owner, name)
-        for r in self.repositories.values():
-            if r.nameWithOwner == nameWithOwner:
-                return r
-        raise RuntimeError("unknown repository {}".format(nameWithOwner))
+        nameWithOwner = f"{owner}/{name}"
+        if (r := self._repositories_by_name.get(nameWithOwner)) is not None:
+            return r
+        raise RuntimeError(f"unknown repository {nameWithOwner}")
 
     def pull_request(self, repo: "Repository", number: GitHubNumber) -> "PullRequest":
-        for pr in self.pull_requests.values():
-            if repo.id == pr._repository and pr.number == number:
-                return pr
+        if (pr := self._pull_requests_by_number.get((repo.id, number))) is not None:
+            return pr
         raise RuntimeError(
-            "unrecognized pull request #{} in repository {}".format(
-                number, repo.nameWithOwner
-            )
+            f"unrecognized pull request #{number} in repository {repo.nameWithOwner}"
         )
 
     def issue_comment(self, repo: "Repository", comment_id: int) -> "IssueComment":
@@ -108,20 +123,23 @@ class GitHubState:
             f"unrecognized issue comment {comment_id} in repository {repo.nameWithOwner}"
         )
 
+    def add_repository(self, repo: "Repository") -> None:
+        self.repositories[repo.id] = repo
+        self._repositories_by_name[repo.nameWithOwner] = repo
+
+    def add_pull_request(self, pr: "PullRequest") -> None:
+        self.pull_requests[pr.id] = pr
+        self._pull_requests_by_number[(pr._repository, pr.number)] = pr
+        self._pull_requests_by_repository.setdefault(pr._repository, []).append(pr)
+
     def next_id(self) -> GraphQLId:
-        r = GraphQLId(str(self._next_id))
-        self._next_id += 1
-        return r
+        return GraphQLId(str(next(self._next_id)))
 
     def next_pull_request_number(self, repo_id: GraphQLId) -> GitHubNumber:
-        r = GitHubNumber(self._next_pull_request_number[repo_id])
-        self._next_pull_request_number[repo_id] += 1
-        return r
+        return GitHubNumber(next(self._next_pull_request_number[repo_id]))
 
     def next_issue_comment_full_database_id(self, repo_id: GraphQLId) -> int:
-        r = self._next_issue_comment_full_database_id[repo_id]
-        self._next_issue_comment_full_database_id[repo_id] += 1
-        return r
+        return next(self._next_issue_comment_full_database_id[repo_id])
 
     def push_hook(self, refs: Sequence[str]) -> None:
         # updated_refs = set(refs)
@@ -141,11 +159,15 @@ class GitHubState:
     def __init__(self, upstream_sh: Optional[ghstack.shell.Shell]) -> None:
         self.repositories = {}
         self.pull_requests = {}
+        self._repositories_by_name = {}
+        self._pull_requests_by_number = {}
+        self._pull_requests_by_repository = {}
         self.issue_comments = {}
-        self._next_id = 5000
+        self._next_id = itertools.count(5000)
         self._next_pull_request_number = {}
         self._next_issue_comment_full_database_id = {}
         self.root = Root()
+        self._objects = {}
 
         # Populate it with the most important repo ;)
         repo = Repository(
@@ -155,9 +177,9 @@ class GitHubState:
             isFork=False,
             defaultBranchRef=None,
         )
-        self.repositories[GraphQLId("1000")] = repo
-        self._next_pull_request_number[GraphQLId("1000")] = 500
-        self._next_issue_comment_full_database_id[GraphQLId("1000")] = 1500
+        self.add_repository(repo)
+        self._next_pull_request_number[repo.id] = itertools.count(500)
+        self._next_issue_comment_full_database_id[repo.id] = itertools.count(1500)
 
         self.upstream_sh = upstream_sh
         if self.upstream_sh is not None:
@@ -179,8 +201,13 @@ class GitHubState:
             repo.defaultBranchRef = repo._make_ref(self, "master")
 
 
+# NB: these all have __slots__ (listing the fields each class adds), as
+# there can be a lot of them; we can't use dataclass(slots=True) as that
+# requires Python 3.10
 @dataclass
 class Node:
+    __slots__ = ("id",)
+
     id: GraphQLId
 
 
@@ -195,6 +222,8 @@ def github_state(info: GraphQLResolveInfo) -> GitHubState:
 
 @dataclass
 class Repository(Node):
+    __slots__ = ("name", "nameWithOwner", "isFork", "defaultBranchRef")
+
     name: str
     nameWithOwner: str
     isFork: bool
@@ -207,38 +236,35 @@ class Repository(Node):
 
     def pullRequests(self, info: GraphQLResolveInfo) -> "PullRequestConnection":
         return PullRequestConnection(
-            nodes=list(
-                filter(
-                    lambda pr: self == pr.repository(info),
-                    github_state(info).pull_requests.values(),
-                )
-            )
+            nodes=github_state(info)._pull_requests_by_repository.get(self.id, [])
         )
 
     # TODO: This should take which repository the ref is in
     # This only works if you have upstream_sh
     def _make_ref(self, state: GitHubState, refName: str) -> "Ref":
-        # TODO: Probably should preserve object identity here when
-        # you call this with refName/oid that are the same
+        # NB: don't memoize the ref itself; it can be moved by pushes we
+        # never hear about (e.g., land pushing to the default branch)
         assert state.upstream_sh
-        gitObject = GitObject(
-            id=state.next_id(),
-            # TODO: this upstream_sh hardcode wrong, but ok for now
-            # because we only have one repo
-            oid=GitObjectID(state.upstream_sh.git("rev-parse", refName)),
-            _repository=self.id,
-        )
-        ref = Ref(
+        # TODO: this upstream_sh hardcode wrong, but ok for now
+        # because we only have one repo
+        oid = GitObjectID(state.upstream_sh.git("rev-parse", refName))
+        # Refs often point at the same commit (e.g., the head of one PR
+        # in a stack is the base of the next), so share the object
+        if (gitObject := state._objects.get((self.id, oid))) is None:
+            gitObject = GitObject(id=state.next_id(), oid=oid, _repository=self.id)
+            state._objects[(self.id, oid)] = gitObject
+        return Ref(
             id=state.next_id(),
             name=refName,
             _repository=self.id,
             target=gitObject,
         )
-        return ref
 
 
 @dataclass
 class GitObject(Node):
+    __slots__ = ("oid", "_repository")
+
     oid: GitObjectID
     _repository: GraphQLId
 
@@ -248,6 +274,8 @@ class GitObject(Node):
 
 @dataclass
 class Ref(Node):
+    __slots__ = ("name", "_repository", "target")
+
     name: str
     _repository: GraphQLId
     target: GitObject
@@ -258,6 +286,19 @@ class Ref(Node):
 
 @dataclass
 class PullRequest(Node):
+    __slots__ = (
+        "baseRef",
+        "baseRefName",
+        "body",
+        "closed",
+        "headRef",
+        "headRefName",
+        "number",
+        "_repository",
+        "title",
+        "url",
+    )
+
     baseRef: Optional[Ref]
     baseRefName: str
     body: str
@@ -278,6 +319,8 @@ class PullRequest(Node):
 
 @dataclass
 class IssueComment(Node):
+    __slots__ = ("body", "fullDatabaseId", "_repository")
+
     body: str
     fullDatabaseId: int
     _repository: GraphQLId
@@ -288,6 +331,8 @@ class IssueComment(Node):
 
 @dataclass
 class PullRequestConnection:
+    __slots__ = ("nodes",)
+
     nodes: List[PullRequest]
 
 
@@ -303,7 +348,7 @@ class Root:
         elif id in github_state(info).issue_comments:
             return github_state(info).issue_comments[id]
         else:
-            raise RuntimeError("unknown id {}".format(id))
+            raise RuntimeError(f"unknown id {id}")
 
 
 with open(
@@ -317,16 +362,40 @@ with open(
 # after a quick read of default_resolve_type_fn it doesn't look like
 # we ever actually look to value for type of information.  This is
 # pretty clunky lol.
-def set_is_type_of(name: str, cls: Any) -> None:
-    # Can't use a type ignore on the next line because fbcode
-    # and us don't agree that it's necessary hmm.
-    o: Any = GITHUB_SCHEMA.get_type(name)
-    o.is_type_of = lambda obj, info: isinstance(obj, cls)
-
-
-set_is_type_of("Repository", Repository)
-set_is_type_of("PullRequest", PullRequest)
-set_is_type_of("IssueComment", IssueComment)
+#
+# Rather than have graphql try every type implementing an interface
+# (Node has a lot of them!) to see which one an object is, we tell it
+# directly based on the object's class.
+GRAPHQL_TYPE_NAMES: Dict[type, str] = {
+    Repository: "Repository",
+    PullRequest: "PullRequest",
+    IssueComment: "IssueComment",
+}
+
+
+def resolve_type(obj: Any, info: GraphQLResolveInfo, abstract_type: Any) -> str:
+    return GRAPHQL_TYPE_NAMES[type(obj)]
+
+
+for t in GITHUB_SCHEMA.type_map.values():
+    if isinstance(t, (graphql.GraphQLInterfaceType, graphql.GraphQLUnionType)):
+        t.resolve_type = resolve_type
+
+
+@functools.lru_cache(maxsize=128)
+def parse_query(
+    query: str,
+) -> Tuple[Optional[graphql.DocumentNode], List[graphql.GraphQLError]]:
+    """
+    Parse and validate a query against GITHUB_SCHEMA, returning the
+    document and any errors.  We send the same handful of queries over
+    and over again, so this is memoized.
+    """
+    try:
+        document = graphql.parse(query)
+    except graphql.GraphQLError as e:
+        return None, [e]
+    return document, graphql.validate(GITHUB_SCHEMA, document)
 
 
 class FakeGitHubEndpoint(ghstack.github.GitHubEndpoint):
@@ -336,13 +405,17 @@ class FakeGitHubEndpoint(ghstack.github.GitHubEndpoint):
         self.state = GitHubState(upstream_sh)
 
     def graphql(self, query: str, **kwargs: Any) -> Any:
-        r = graphql.graphql_sync(
-            schema=GITHUB_SCHEMA,
-            source=query,
-            root_value=self.state.root,
-            context_value=self.state,
-            variable_values=kwargs,
-        )
+        document, errors = parse_query(query)
+        if document is None or errors:
+            r = graphql.ExecutionResult(data=None, errors=errors)
+        else:
+            r = graphql.execute_sync(
+                schema=GITHUB_SCHEMA,
+                document=document,
+                root_value=self.state.root,
+                context_value=self.state,
+                variable_values=kwargs,
+            )
         if r.errors:
             # The GraphQL implementation loses all the stack traces!!!
             # D:  You can 'recover' them by deleting the
@@ -382,7 +455,7 @@ class FakeGitHubEndpoint(ghstack.github.GitHubEndpoint):
             _repository=repo.id,
             number=number,
             closed=False,
-            url="https://github.com/{}/pull/{}".format(repo.nameWithOwner, number),
+            url=f"https://github.com/{repo.nameWithOwner}/pull/{number}",
             baseRef=baseRef,
             baseRefName=input["base"],
             headRef=headRef,
@@ -391,7 +464,7 @@ class FakeGitHubEndpoint(ghstack.github.GitHubEndpoint):
             body=input["body"],
         )
         # TODO: compute files changed
-        state.pull_requests[id] = pr
+        state.add_pull_request(pr)
         # This is only a subset of what the actual REST endpoint
         # returns.
         return {
@@ -406,15 +479,13 @@ class FakeGitHubEndpoint(ghstack.github.GitHubEndpoint):
         state = self.state
         repo = state.repository(owner, name)
         pr = state.pull_request(repo, number)
-        # If I say input.get('title') is not None, mypy
-        # is unable to infer input['title'] is not None
-        if "title" in input and input["title"] is not None:
-            pr.title = input["title"]
-        if "base" in input and input["base"] is not None:
-            pr.baseRefName = input["base"]
-            pr.baseRef = repo._make_ref(state, pr.baseRefName)
-        if "body" in input and input["body"] is not None:
-            pr.body = input["body"]
+        if (title := input.get("title")) is not None:
+            pr.title = title
+        if (base := input.get("base")) is not None:
+            pr.baseRefName = base
+            pr.baseRef = repo._make_ref(state, base)
+        if (body := input.get("body")) is not None:
+            pr.body = body
 
     def _create_issue_comment(
         self, owner: str, name: str, comment_id: int, input: CreateIssueCommentInput
@@ -456,17 +527,17 @@ class FakeGitHubEndpoint(ghstack.github.GitHubEndpoint):
 
     def rest(self, method: str, path: str, **kwargs: Any) -> Any:
         if method == "get":
-            m = re.match(r"^repos/([^/]+)/([^/]+)/branches/([^/]+)/protection", path)
+            m = RE_BRANCH_PROTECTION_PATH.match(path)
             if m:
                 # For now, pretend all branches are not protected
                 raise ghstack.github.NotFoundError()
 
         elif method == "post":
-            if m := re.match(r"^repos/([^/]+)/([^/]+)/pulls$", path):
+            if m := RE_PULLS_PATH.match(path):
                 return self._create_pull(
                     m.group(1), m.group(2), cast(CreatePullRequestInput, kwargs)
                 )
-            if m := re.match(r"^repos/([^/]+)/([^/]+)/issues/([^/]+)/comments", path):
+            if m := RE_ISSUE_COMMENTS_PATH.match(path):
                 return self._create_issue_comment(
                     m.group(1),
                     m.group(2),
@@ -474,7 +545,7 @@ class FakeGitHubEndpoint(ghstack.github.GitHubEndpoint):
                     cast(CreateIssueCommentInput, kwargs),
                 )
         elif method == "patch":
-            if m := re.match(r"^repos/([^/]+)/([^/]+)(?:/pulls/([^/]+))?$", path):
+            if m := RE_REPO_OR_PULL_PATH.match(path):
                 owner, name, number = m.groups()
                 if number is not None:
                     return self._update_pull(
@@ -487,7 +558,7 @@ class FakeGitHubEndpoint(ghstack.github.GitHubEndpoint):
                     return self._set_default_branch(
                         owner, name, cast(SetDefaultBranchInput, kwargs)
                     )
-            if m := re.match(r"^repos/([^/]+)/([^/]+)/issues/comments/([^/]+)$", path):
+            if m := RE_ISSUE_COMMENT_PATH.match(path):
                 return self._update_issue_comment(
                     m.group(1),
                     m.group(2),
@@ -495,5 +566,5 @@ class FakeGitHubEndpoint(ghstack.github.GitHubEndpoint):
                     cast(UpdateIssueCommentInput, kwargs),
                 )
         raise NotImplementedError(
-            "FakeGitHubEndpoint REST {} {} not implemented".format(method.upper(), path)
+            f"FakeGitHubEndpoint REST {method.upper()} {path} not implemented"
         )
@@ -3,12 +3,42 @@
 import json
 import logging
 import re
+import time
 from typing import Any, Dict, Optional, Sequence, Tuple, Union
 
 import requests
+import requests.adapters
+from urllib3.util.retry import Retry
 
+import ghstack.cache
+import ghstack.diff
 import ghstack.github
 
+# Where the head ref of a pull request appears on its web page
+RE_CLIPBOARD_HEAD_REF = re.compile(r'<clipboard-copy.+?value="(gh/[^/]+/\d+/head)"')
+
+RE_GRAPHQL_MUTATION = re.compile(r"\s*mutation\b")
+
+# How long (in seconds) we reuse the result of a GraphQL query, if we
+# send the exact same query again
+GRAPHQL_CACHE_TTL = 5
+
+# (connect, read) timeouts, in seconds, for our requests to GitHub
+TIMEOUT = (10, 60)
+
+# Retry requests that failed due to a (hopefully) transient error on
+# GitHub's end, backing off a bit more each time.  NB: this only applies
+# to idempotent methods (so not POST, which all GraphQL requests are),
+# as we can't tell if a failed mutation took effect or not.
+# If we run out of retries, we hand back the last response we got, so it
+# gets reported like any other error.
+RETRY = Retry(
+    total=5,
+    backoff_factor=0.3,
+    status_forcelist=(429, 500, 502, 503, 504),
+    raise_on_status=False,
+)
+
 
 class RealGitHubEndpoint(ghstack.github.GitHubEndpoint):
     """
@@ -53,6 +83,24 @@ class RealGitHubEndpoint(ghstack.github.GitHubEndpoint):
     # Passed to requests as 'cert'.
     cert: Optional[Union[str, Tuple[str, str]]]
 
+    # Session shared by all of our requests, so that we can reuse
+    # connections (and skip the TLS handshake) across API calls
+    session: requests.Session
+
+    # Headers sent with every GraphQL request
+    _graphql_headers: Dict[str, str]
+
+    # Recent results of GraphQL queries, keyed on the query and its
+    # variables, along with when we got them.  Anything we do that may
+    # change what's on GitHub clears this out.
+    _graphql_cache: Dict[str, Tuple[float, Any]]
+
+    # Headers sent with every REST request
+    _rest_headers: Dict[str, str]
+
+    # Proxies to pass to requests, per the proxy setting above
+    _proxies: Dict[str, str]
+
     def __init__(
         self,
         oauth_token: Optional[str],
@@ -66,15 +114,56 @@ class RealGitHubEndpoint(ghstack.github.GitHubEndpoint):
         self.github_url = github_url
         self.verify = verify
         self.cert = cert
+        self.session = requests.Session()
+        # Pool connections for each host we talk to (the API endpoint and,
+        # when scraping head refs, the website), so they can be reused
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=10, pool_maxsize=20, max_retries=RETRY
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._graphql_headers = {}
+        if oauth_token:
+            self._graphql_headers["Authorization"] = "bearer {}".format(oauth_token)
+        self._graphql_cache = {}
+        self._rest_headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "ghstack",
+            "Accept": "application/vnd.github.v3+json",
+        }
+        if oauth_token:
+            self._rest_headers["Authorization"] = "token " + oauth_token
+        if proxy:
+            self._proxies = {"http": proxy, "https": proxy}
+        else:
+            self._proxies = {}
 
     def push_hook(self, refName: Sequence[str]) -> None:
-        pass
+        # Pushing may change the pull requests on these branches
+        self._graphql_cache.clear()
+
+    def notify_merged(self, pr_resolved: ghstack.diff.PullRequestResolved) -> None:
+        self._graphql_cache.clear()
+
+    def close(self) -> None:
+        self.session.close()
 
     def graphql(self, query: str, **kwargs: Any) -> Any:
-        headers = {}
-        if self.oauth_token:
-            headers["Authorization"] = "bearer {}".format(self.oauth_token)
+        if RE_GRAPHQL_MUTATION.match(query):
+            self._graphql_cache.clear()
+            return self._graphql(query, **kwargs)
+        key = query + "\0" + json.dumps(kwargs, sort_keys=True)
+        now = time.monotonic()
+        if (cached := self._graphql_cache.get(key)) is not None:
+            timestamp, r = cached
+            if now - timestamp < GRAPHQL_CACHE_TTL:
+                logging.debug("Reusing result of identical GraphQL query")
+                return r
+        r = self._graphql(query, **kwargs)
+        self._graphql_cache[key] = (now, r)
+        return r
 
+    def _graphql(self, query: str, **kwargs: Any) -> Any:
         logging.debug(
             "# POST {}".format(self.graphql_endpoint.format(github_url=self.github_url))
         )
@@ -83,13 +172,14 @@ class RealGitHubEndpoint(ghstack.github.GitHubEndpoint):
             "Request GraphQL variables:\n{}".format(json.dumps(kwargs, indent=1))
         )
 
-        resp = requests.post(
+        resp = self.session.post(
             self.graphql_endpoint.format(github_url=self.github_url),
             json={"query": query, "variables": kwargs},
-            headers=headers,
-            proxies=self._proxies(),
+            headers=self._graphql_headers,
+            proxies=self._proxies,
             verify=self.verify,
             cert=self.cert,
+            timeout=TIMEOUT,
         )
 
         logging.debug("Response status: {}".format(resp.status_code))
@@ -116,12 +206,6 @@ class RealGitHubEndpoint(ghstack.github.GitHubEndpoint):
 
         return r
 
-    def _proxies(self) -> Dict[str, str]:
-        if self.proxy:
-            return {"http": self.proxy, "https": self.proxy}
-        else:
-            return {}
-
     def get_head_ref(self, **params: Any) -> str:
 
         if self.oauth_token:
@@ -130,16 +214,17 @@ class RealGitHubEndpoint(ghstack.github.GitHubEndpoint):
             owner = params["owner"]
             name = params["name"]
             number = params["number"]
-            resp = requests.get(
+            resp = self.session.get(
                 f"{self.www_endpoint.format(github_url=self.github_url)}/{owner}/{name}/pull/{number}",
-                proxies=self._proxies(),
+                proxies=self._proxies,
                 verify=self.verify,
                 cert=self.cert,
+                timeout=TIMEOUT,
             )
             logging.debug("Response status: {}".format(resp.status_code))
 
             r = resp.text
-            if m := re.search(r'<clipboard-copy.+?value="(gh/[^/]+/\d+/head)"', r):
+            if m := RE_CLIPBOARD_HEAD_REF.search(r):
                 return m.group(1)
             else:
                 # couldn't find, fall back to regular query
@@ -147,32 +232,45 @@ class RealGitHubEndpoint(ghstack.github.GitHubEndpoint):
 
     def rest(self, method: str, path: str, **kwargs: Any) -> Any:
         assert self.oauth_token
-        headers = {
-            "Authorization": "token " + self.oauth_token,
-            "Content-Type": "application/json",
-            "User-Agent": "ghstack",
-            "Accept": "application/vnd.github.v3+json",
-        }
+        headers = self._rest_headers
+
+        if method != "get":
+            self._graphql_cache.clear()
 
         url = self.rest_endpoint.format(github_url=self.github_url) + "/" + path
         logging.debug("# {} {}".format(method, url))
         logging.debug("Request body:\n{}".format(json.dumps(kwargs, indent=1)))
 
-        resp: requests.Response = getattr(requests, method)(
+        # For GETs, remember the ETag of what we got last time, so GitHub can
+        # tell us it hasn't changed (which doesn't count against our rate
+        # limit) instead of sending the whole thing again
+        cached = None
+        if method == "get" and not kwargs:
+            if (cache_result := ghstack.cache.get("github_etag", url)) is not None:
+                cached = json.loads(cache_result)
+                headers = {**headers, "If-None-Match": cached["etag"]}
+
+        resp = self.session.request(
+            method.upper(),
             url,
             json=kwargs,
             headers=headers,
-            proxies=self._proxies(),
+            proxies=self._proxies,
             verify=self.verify,
             cert=self.cert,
+            timeout=TIMEOUT,
         )
 
         logging.debug("Response status: {}".format(resp.status_code))
 
+        if resp.status_code == 304 and cached is not None:
+            logging.debug("Not modified, using result from cache")
+            return cached["body"]
+
         try:
             r = resp.json()
         except ValueError:
-            logging.debug("Response body:\n{}".format(r.text))
+            logging.debug("Response body:\n{}".format(resp.text))
             raise
         else:
             pretty_json = json.dumps(r, indent=1)
@@ -199,4 +297,7 @@ value.
         except requests.HTTPError:
             raise RuntimeError(pretty_json)
 
+        if method == "get" and not kwargs and (etag := resp.headers.get("ETag")):
+            ghstack.cache.put("github_etag", url, json.dumps({"etag": etag, "body": r}))
+
         return r
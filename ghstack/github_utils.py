@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
+import functools
 import re
-from typing import Optional
+from typing import Optional, Pattern, Tuple
 
 from typing_extensions import TypedDict
 
@@ -18,6 +19,19 @@ GitHubRepoNameWithOwner = TypedDict(
 )
 
 
+@functools.lru_cache()
+def remote_url_patterns(github_url: str) -> Tuple[Pattern[str], Pattern[str]]:
+    """
+    Patterns matching SSH and HTTPS remote URLs for repositories on
+    github_url, respectively.
+    """
+    github_url = re.escape(github_url)
+    return (
+        re.compile(rf"^git@{github_url}:/?([^/]+)/(.+?)(?:\.git)?$"),
+        re.compile(rf"{github_url}/([^/]+)/(.+?)(?:\.git)?$"),
+    )
+
+
 def get_github_repo_name_with_owner(
     *,
     sh: ghstack.shell.Shell,
@@ -26,25 +40,13 @@ def get_github_repo_name_with_owner(
 ) -> GitHubRepoNameWithOwner:
     # Grovel in remotes to figure it out
     remote_url = sh.git("remote", "get-url", remote_name)
-    while True:
-        match = r"^git@{github_url}:/?([^/]+)/(.+?)(?:\.git)?$".format(
-            github_url=github_url
-        )
-        m = re.match(match, remote_url)
-        if m:
-            owner = m.group(1)
-            name = m.group(2)
-            break
-        search = r"{github_url}/([^/]+)/(.+?)(?:\.git)?$".format(github_url=github_url)
-        m = re.search(search, remote_url)
-        if m:
-            owner = m.group(1)
-            name = m.group(2)
-            break
+    ssh_re, https_re = remote_url_patterns(github_url)
+    m = ssh_re.match(remote_url) or https_re.search(remote_url)
+    if not m:
         raise RuntimeError(
             "Couldn't determine repo owner and name from url: {}".format(remote_url)
         )
-    return {"owner": owner, "name": name}
+    return {"owner": m.group(1), "name": m.group(2)}
 
 
 GitHubRepoInfo = TypedDict(
@@ -76,7 +78,10 @@ def get_github_repo_info(
     else:
         name_with_owner = {"owner": repo_owner, "name": repo_name}
 
-    # TODO: Cache this guy
+    # NB: don't cache this across the process; the default branch can be
+    # changed under us (we do it ourselves in tests).  RealGitHubEndpoint
+    # already reuses the result if we ask again shortly, until we next
+    # write to GitHub.
     repo = github.graphql(
         """
         query ($owner: String!, $name: String!) {
@@ -101,7 +106,7 @@ def get_github_repo_info(
 
 
 RE_PR_URL = re.compile(
-    r"^https://(?P<github_url>[^/]+)/(?P<owner>[^/]+)/(?P<name>[^/]+)/pull/(?P<number>[0-9]+)/?$"
+    r"https://(?P<github_url>[^/]+)/(?P<owner>[^/]+)/(?P<name>[^/]+)/pull/(?P<number>[0-9]+)/?"
 )
 
 GitHubPullRequestParams = TypedDict(
@@ -121,7 +126,7 @@ def parse_pull_request(
     sh: Optional[ghstack.shell.Shell] = None,
     remote_name: Optional[str] = None,
 ) -> GitHubPullRequestParams:
-    m = RE_PR_URL.match(pull_request)
+    m = RE_PR_URL.fullmatch(pull_request)
     if not m:
         # We can reconstruct the URL if just a PR number is passed
         if sh is not None and remote_name is not None:
@@ -2,7 +2,7 @@
 
 import logging
 import re
-from typing import List, Tuple
+from typing import Any, List, Sequence, Tuple
 
 import ghstack.git
 import ghstack.github
@@ -11,30 +11,37 @@ import ghstack.shell
 from ghstack.diff import PullRequestResolved
 from ghstack.types import GitCommitHash
 
+RE_HEAD_SUFFIX = re.compile(r"/head$")
 
-def lookup_pr_to_orig_ref_and_closed(
-    github: ghstack.github.GitHubEndpoint, *, owner: str, name: str, number: int
-) -> Tuple[str, bool]:
-    pr_result = github.graphql(
+RE_ORIG_SUFFIX = re.compile(r"/orig$")
+
+
+def _pull_request_read(
+    *, owner: str, name: str, number: int
+) -> ghstack.github.GraphQLRead:
+    return ghstack.github.GraphQLRead(
         """
-        query ($owner: String!, $name: String!, $number: Int!) {
-            repository(name: $name, owner: $owner) {
-                pullRequest(number: $number) {
-                    headRefName
-                    closed
-                }
+        repository(name: $name, owner: $owner) {
+            pullRequest(number: $number) {
+                headRefName
+                closed
             }
         }
-    """,
-        owner=owner,
-        name=name,
-        number=number,
+        """,
+        {
+            "owner": ("String!", owner),
+            "name": ("String!", name),
+            "number": ("Int!", number),
+        },
     )
-    pr = pr_result["data"]["repository"]["pullRequest"]
+
+
+def _orig_ref_and_closed(r: Any) -> Tuple[str, bool]:
+    pr = r["pullRequest"]
     head_ref = pr["headRefName"]
     closed = pr["closed"]
     assert isinstance(head_ref, str)
-    orig_ref = re.sub(r"/head$", "/orig", head_ref)
+    orig_ref = RE_HEAD_SUFFIX.sub("/orig", head_ref)
     if orig_ref == head_ref:
         raise RuntimeError(
             "The ref {} doesn't look like a ghstack reference".format(head_ref)
@@ -42,6 +49,31 @@ def lookup_pr_to_orig_ref_and_closed(
     return orig_ref, closed
 
 
+def lookup_pr_to_orig_ref_and_closed(
+    github: ghstack.github.GitHubEndpoint, *, owner: str, name: str, number: int
+) -> Tuple[str, bool]:
+    (r,) = github.batch_graphql(
+        [_pull_request_read(owner=owner, name=name, number=number)]
+    )
+    return _orig_ref_and_closed(r)
+
+
+def lookup_prs_to_orig_ref_and_closed(
+    github: ghstack.github.GitHubEndpoint, prs: Sequence[PullRequestResolved]
+) -> List[Tuple[str, bool]]:
+    """
+    Like lookup_pr_to_orig_ref_and_closed, but for many pull requests at
+    once, in a single query.
+    """
+    results = github.batch_graphql(
+        [
+            _pull_request_read(owner=pr.owner, name=pr.repo, number=pr.number)
+            for pr in prs
+        ]
+    )
+    return [_orig_ref_and_closed(r) for r in results]
+
+
 def main(
     pull_request: str,
     remote_name: str,
@@ -112,10 +144,10 @@ to complain to the ghstack authors."""
 
     # compute the stack of commits in chronological order (does not
     # include base)
-    stack = ghstack.git.parse_header(
-        sh.git("rev-list", "--reverse", "--header", "^" + base, remote_orig_ref),
-        github_url=github_url,
-    )
+    stack = [
+        ghstack.git.convert_header(h, github_url)
+        for h in ghstack.git.rev_list(sh, "--reverse", "^" + base, remote_orig_ref)
+    ]
 
     # Switch working copy
     try:
@@ -129,17 +161,17 @@ to complain to the ghstack authors."""
     try:
         # Compute the metadata for each commit
         stack_orig_refs: List[Tuple[str, PullRequestResolved]] = []
+        stack_prs = []
         for s in stack:
             pr_resolved = s.pull_request_resolved
             # We got this from GitHub, this better not be corrupted
             assert pr_resolved is not None
+            stack_prs.append(pr_resolved)
 
-            ref, closed = lookup_pr_to_orig_ref_and_closed(
-                github,
-                owner=pr_resolved.owner,
-                name=pr_resolved.repo,
-                number=pr_resolved.number,
-            )
+        # Look them all up in one go, rather than one request per commit
+        for pr_resolved, (ref, closed) in zip(
+            stack_prs, lookup_prs_to_orig_ref_and_closed(github, stack_prs)
+        ):
             if closed and not force:
                 continue
             stack_orig_refs.append((ref, pr_resolved))
@@ -166,8 +198,8 @@ to complain to the ghstack authors."""
 
         for orig_ref, pr_resolved in stack_orig_refs:
             # TODO: regex here so janky
-            base_ref = re.sub(r"/orig$", "/base", orig_ref)
-            head_ref = re.sub(r"/orig$", "/head", orig_ref)
+            base_ref = RE_ORIG_SUFFIX.sub("/base", orig_ref)
+            head_ref = RE_ORIG_SUFFIX.sub("/head", orig_ref)
             sh.git("push", remote_name, f"{remote_name}/{head_ref}:{base_ref}")
             github.notify_merged(pr_resolved)
 
@@ -182,8 +214,8 @@ to complain to the ghstack authors."""
         # Delete the branches
         for orig_ref, _ in stack_orig_refs:
             # TODO: regex here so janky
-            base_ref = re.sub(r"/orig$", "/base", orig_ref)
-            head_ref = re.sub(r"/orig$", "/head", orig_ref)
+            base_ref = RE_ORIG_SUFFIX.sub("/base", orig_ref)
+            head_ref = RE_ORIG_SUFFIX.sub("/head", orig_ref)
             try:
                 sh.git("push", remote_name, "--delete", orig_ref, base_ref, head_ref)
             except RuntimeError:
@@ -3,7 +3,7 @@
 import datetime
 import os
 import tempfile
-from typing import Dict, NewType
+from typing import Dict, NewType, Optional
 
 import ghstack
 import ghstack.logs
@@ -12,22 +12,24 @@ RawIndex = NewType("RawIndex", int)
 FilteredIndex = NewType("FilteredIndex", int)
 
 
+def read_run_file(log_dir: str, name: str) -> Optional[str]:
+    # NB: just try to open the file, rather than stat'ing it first; most
+    # of these files exist for most runs
+    try:
+        with open(os.path.join(log_dir, name), "r") as f:
+            return f.read().rstrip()
+    except FileNotFoundError:
+        return None
+
+
 def get_argv(log_dir: str) -> str:
-    argv = "Unknown"
-    argv_fn = os.path.join(log_dir, "argv")
-    if os.path.exists(argv_fn):
-        with open(argv_fn, "r") as f:
-            argv = f.read().rstrip()
-    return argv
+    argv = read_run_file(log_dir, "argv")
+    return "Unknown" if argv is None else argv
 
 
 def get_status(log_dir: str) -> str:
-    status = ""
-    status_fn = os.path.join(log_dir, "status")
-    if os.path.exists(status_fn):
-        with open(status_fn, "r") as f:
-            status = f.read().rstrip()
-    return status
+    status = read_run_file(log_dir, "status")
+    return "" if status is None else status
 
 
 def main(latest: bool = False) -> None:
@@ -84,11 +86,11 @@ def main(latest: bool = False) -> None:
                 )
             else:
                 date = "Unknown"
-            exception = "Succeeded"
-            exception_fn = os.path.join(log_base, fn, "exception")
-            if os.path.exists(exception_fn):
-                with open(exception_fn, "r") as f:
-                    exception = "Failed with: " + f.read().rstrip()
+            exception = read_run_file(log_dir, "exception")
+            if exception is None:
+                exception = "Succeeded"
+            else:
+                exception = "Failed with: " + exception
 
             print(
                 "{:<5}  {}  [{}]  {}{}".format(
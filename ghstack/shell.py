@@ -1,12 +1,27 @@
 #!/usr/bin/env python3
 
 import asyncio
+import contextlib
+import io
 import logging
 import os
 import shlex
 import subprocess
 import sys
-from typing import Any, Dict, IO, Optional, overload, Sequence, Tuple, TypeVar, Union
+import tempfile
+from typing import (
+    Any,
+    ContextManager,
+    Dict,
+    IO,
+    Iterator,
+    Optional,
+    overload,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 # Shell commands generally return str, but with exitcode=True
 # they return a bool, and if stdout is piped straight to sys.stdout
@@ -92,7 +107,7 @@ class Shell(object):
         stdin: _HANDLE = None,
         stdout: _HANDLE = subprocess.PIPE,
         exitcode: bool = False,
-        tick: bool = False
+        tick: bool = False,
     ) -> _SHELL_RET:
         """
         Run a command specified by args, and return string representing
@@ -253,32 +268,97 @@ class Shell(object):
             **kwargs: Any valid kwargs for sh()
         """
         env = kwargs.setdefault("env", {})
+        for k, v in self._git_env().items():
+            env.setdefault(k, v)
+        if self.testing and "stderr" not in kwargs:
+            kwargs["stderr"] = subprocess.PIPE
+
+        return self._maybe_rstrip(self.sh(*(("git",) + args), **kwargs))
+
+    def _git_env(self) -> Dict[str, str]:
+        """
+        Compute the extra environment variables to set when running git.
+        """
+        env = {}
         # For git hooks to detect execution inside ghstack
-        env.setdefault("GHSTACK", "1")
+        env["GHSTACK"] = "1"
         # For dealing with https://github.com/ezyang/ghstack/issues/174
-        env.setdefault(
-            "GIT_TERMINAL_PROMPT", os.environ.get("GIT_TERMINAL_PROMPT", "0")
-        )
+        env["GIT_TERMINAL_PROMPT"] = os.environ.get("GIT_TERMINAL_PROMPT", "0")
         # Some envvars to make things a little more script mode nice
         if self.testing:
-            env.setdefault("EDITOR", ":")
-            env.setdefault("GIT_MERGE_AUTOEDIT", "no")
-            env.setdefault("LANG", "C")
-            env.setdefault("LC_ALL", "C")
-            env.setdefault("PAGER", "cat")
-            env.setdefault("TZ", "UTC")
-            env.setdefault("TERM", "dumb")
+            env["EDITOR"] = ":"
+            env["GIT_MERGE_AUTOEDIT"] = "no"
+            env["LANG"] = "C"
+            env["LC_ALL"] = "C"
+            env["PAGER"] = "cat"
+            env["TZ"] = "UTC"
+            env["TERM"] = "dumb"
             # These are important so we get deterministic commit times
-            env.setdefault("GIT_AUTHOR_EMAIL", "author@example.com")
-            env.setdefault("GIT_AUTHOR_NAME", "A U Thor")
-            env.setdefault("GIT_COMMITTER_EMAIL", "committer@example.com")
-            env.setdefault("GIT_COMMITTER_NAME", "C O Mitter")
-            env.setdefault("GIT_COMMITTER_DATE", "{} -0700".format(self.testing_time))
-            env.setdefault("GIT_AUTHOR_DATE", "{} -0700".format(self.testing_time))
-            if "stderr" not in kwargs:
-                kwargs["stderr"] = subprocess.PIPE
+            env["GIT_AUTHOR_EMAIL"] = "author@example.com"
+            env["GIT_AUTHOR_NAME"] = "A U Thor"
+            env["GIT_COMMITTER_EMAIL"] = "committer@example.com"
+            env["GIT_COMMITTER_NAME"] = "C O Mitter"
+            env["GIT_COMMITTER_DATE"] = "{} -0700".format(self.testing_time)
+            env["GIT_AUTHOR_DATE"] = "{} -0700".format(self.testing_time)
+        return env
+
+    def git_popen(self, *args: str) -> Iterator[str]:
+        """
+        Run a git command whose stdout consists of NUL-terminated records
+        (e.g., `git rev-list --header`), yielding each record as soon as
+        it has been read, rather than waiting for the command to finish
+        and splitting its entire output.  Raises an error if the exit code
+        was nonzero.
 
-        return self._maybe_rstrip(self.sh(*(("git",) + args), **kwargs))
+        Args:
+            *args: Arguments to git
+        """
+        cmd = ("git",) + args
+        if not self.quiet:
+            log_command(cmd)
+        env = merge_dicts(dict(os.environ), self._git_env())
+        # Like git(), only capture stderr when testing; otherwise it goes
+        # straight to the user's terminal so they can see why git failed
+        err_file: ContextManager[Optional[IO[bytes]]] = (
+            tempfile.TemporaryFile() if self.testing else contextlib.nullcontext()
+        )
+        with err_file as err, subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=err,
+            cwd=self.cwd,
+            env=env,
+            # Unbuffered, so that reads return as soon as any output is
+            # available, rather than waiting to fill a buffer
+            bufsize=0,
+        ) as proc:
+            assert proc.stdout is not None
+            finished = False
+            try:
+                buf = b""
+                while chunk := proc.stdout.read(io.DEFAULT_BUFFER_SIZE):
+                    *records, buf = (buf + chunk).split(b"\0")
+                    for record in records:
+                        r = record.decode()
+                        logging.debug(r)
+                        yield r
+                finished = True
+            finally:
+                # If our consumer stopped early, don't leave git blocked
+                # writing to a pipe nobody is reading
+                if not finished:
+                    proc.kill()
+            returncode = proc.wait()
+            err_out = b""
+            if err is not None:
+                err.seek(0)
+                err_out = err.read()
+        if err_out:
+            logging.debug("# stderr:\n" + err_out.decode(errors="backslashreplace"))
+        if returncode != 0:
+            raise RuntimeError(
+                "{} failed with exit code {}".format(" ".join(cmd), returncode)
+            )
 
     @overload  # noqa: F811
     def hg(self, *args: str) -> str: ...
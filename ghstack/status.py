@@ -2,10 +2,11 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import json
 import logging
 import re
+from typing import List
 
-import aiohttp
 from typing_extensions import TypedDict
 
 import ghstack.circleci
@@ -14,19 +15,67 @@ import ghstack.github_utils
 
 RE_CIRCLECI_URL = re.compile(r"^https://circleci.com/gh/pytorch/pytorch/([0-9]+)")
 
+# How many CircleCI requests we have in flight at once (shared with
+# ghstack.forensics)
+MAX_CONCURRENT_REQUESTS = 10
+
+# How we display each CI state; states not in here are displayed as is
+STATE_EMOJI = {
+    "SUCCESS": "✅",
+    "SKIPPED": "❔",
+    "CANCELED": "💜",
+    "PENDING": "🚸",
+    "FAILURE": "❌",
+}
+
+
+SCCACHE_MARKER = "=================== sccache compilation log ==================="
+
+# How much of the end of a failing job's log we show
+LOG_TAIL_SIZE = 1500
+
 
 def strip_sccache(x: str) -> str:
-    sccache_marker = "=================== sccache compilation log ==================="
-    marker_pos = x.rfind(sccache_marker)
+    marker_pos = x.rfind(SCCACHE_MARKER)
+    # No sccache log, nothing to strip (without this check, we would
+    # chop off the last line instead)
+    if marker_pos < 0:
+        return x
     newline_before_marker_pos = x.rfind("\n", 0, marker_pos)
+    if newline_before_marker_pos < 0:
+        return ""
     return x[:newline_before_marker_pos]
 
 
+def log_tail(messages: List[str]) -> str:
+    """
+    The end of a CircleCI log (sans sccache log), given its messages.
+    Logs can be enormous, so rather than join up the entire thing, we
+    only join the messages that can actually make it into the tail.
+    """
+    # The sccache log comes last, so everything after it is dropped
+    end = len(messages)
+    for i in reversed(range(end)):
+        if SCCACHE_MARKER in messages[i]:
+            end = i + 1
+            break
+    # Then walk backwards until we have enough text preceding it
+    start = max(end - 1, 0)
+    size = 0
+    while start > 0 and size <= LOG_TAIL_SIZE:
+        start -= 1
+        size += len(messages[start]) + 1
+    return ("\n" + strip_sccache("\n".join(messages[start:end])))[-LOG_TAIL_SIZE:]
+
+
 async def main(
     pull_request: str,  # noqa: C901
     github: ghstack.github.GitHubEndpoint,
     circleci: ghstack.circleci.CircleCIEndpoint,
 ) -> None:
+    # NB: imported here, so that importing this module (e.g., for
+    # strip_sccache) doesn't pull in aiohttp
+    import aiohttp
 
     # Game plan:
     # 1. Query GitHub to find out what the current statuses are
@@ -110,28 +159,17 @@ async def main(
                 else:
                     state = "SUCCESS"
             if state == "FAILURE":
-                async with aiohttp.request(
-                    "get", r["steps"][-1]["actions"][-1]["output_url"]
+                async with log_session.get(
+                    r["steps"][-1]["actions"][-1]["output_url"]
                 ) as resp:
-                    log_json = await resp.json()
-                    buf = []
-                    for e in log_json:
-                        buf.append(e["message"])
-                    text = "\n" + strip_sccache("\n".join(buf))
-                    text = text[-1500:]
+                    # NB: json.loads takes bytes directly, so skip decoding the
+                    # (potentially enormous) body to a str
+                    log_json = json.loads(await resp.read())
+                    text = log_tail([e["message"] for e in log_json])
         else:
             state = context["state"]
 
-        if state == "SUCCESS":
-            state = "✅"
-        elif state == "SKIPPED":
-            state = "❔"
-        elif state == "CANCELED":
-            state = "💜"
-        elif state == "PENDING":
-            state = "🚸"
-        elif state == "FAILURE":
-            state = "❌"
+        state = STATE_EMOJI.get(state, state)
         name = context["context"]
         url = context["targetUrl"]
         url = url.replace(
@@ -140,7 +178,15 @@ async def main(
         )
         return "{} {} {}{}".format(state, name.ljust(70), url, text)
 
-    results = await asyncio.gather(
-        *[asyncio.ensure_future(process_context(c)) for c in contexts]
-    )
+    # Process all of the contexts concurrently, but don't have too many
+    # requests to CircleCI in flight at once, so we don't get rate limited
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def process_context_limited(context: ContextPayload) -> str:
+        async with semaphore:
+            return await process_context(context)
+
+    # NB: the session is closed before we leave the event loop
+    async with aiohttp.ClientSession() as log_session:
+        results = await asyncio.gather(*map(process_context_limited, contexts))
     print("\n".join(sorted(results)))
@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 
 import dataclasses
+import functools
 import itertools
 import logging
 import os
 import re
+import time
 from dataclasses import dataclass
-from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 
 import ghstack
+import ghstack.cache
 import ghstack.git
 import ghstack.github
 import ghstack.github_utils
@@ -27,6 +30,8 @@ BranchKind = str
 class GhCommit:
     commit_id: GitCommitHash
     tree: str
+    # Only known for commits we resolved from the remote
+    parents: Tuple[GitCommitHash, ...] = ()
 
 
 # Commit can be None if this is a completely fresh PR
@@ -138,6 +143,9 @@ RE_GHSTACK_COMMENT_ID = re.compile(r"^ghstack-comment-id: (.+)\n?", re.MULTILINE
 #     for the PR itself (because that PR was not submitted)
 
 
+# NB: cached, as we ask for the same handful of branch names over and
+# over again while processing a stack
+@functools.lru_cache(maxsize=1024)
 def branch(username: str, ghnum: GhNumber, kind: BranchKind) -> GitCommitHash:
     return GitCommitHash("gh/{}/{}/{}".format(username, ghnum, kind))
 
@@ -160,6 +168,14 @@ def branch_next(username: str, ghnum: GhNumber) -> GitCommitHash:
 
 RE_MENTION = re.compile(r"(?<!\w)@([a-z\d](?:[a-z\d]|-(?=[a-z\d])){0,38})", re.I)
 
+RE_BULLET = re.compile(r"^[\s\t]*[*\-+][\s\t]+")
+
+RE_GHEXPORT_HEAD_REF = re.compile(r"(refs/heads/)?export-D([0-9]+)$")
+
+RE_GH_HEAD_REF = re.compile(r"gh/([^/]+)/([0-9]+)/head$")
+
+RE_GIT_COMMIT_HASH = re.compile(r"[a-f0-9]{40}")
+
 
 # Replace GitHub mentions with non mentions, to prevent spamming people
 def strip_mentions(body: str) -> str:
@@ -176,7 +192,7 @@ def starts_with_bullet(body: str) -> bool:
     Returns True if the string in question begins with a Markdown
     bullet list
     """
-    return bool(re.match(r"^[\s\t]*[*\-+][\s\t]+", body))
+    return bool(RE_BULLET.match(body))
 
 
 @dataclass
@@ -339,6 +355,14 @@ class Submitter:
     # Check that invariants are upheld during execution
     check_invariants: bool = False
 
+    # Skip the initial fetch if ghstack fetched the remote less than this
+    # many seconds ago.  If None, we always fetch.
+    fetch_max_age: Optional[float] = None
+
+    # Never do the initial fetch; work with whatever remote branches we
+    # already have locally
+    no_fetch: bool = False
+
     # Instead of merging into base branch, merge directly into the appropriate
     # main or head branch.  Change merge targets appropriately as PRs get
     # merged.  If None, infer whether or not the PR should be direct or not.
@@ -423,7 +447,12 @@ class Submitter:
     # The main algorithm
 
     def run(self) -> List[DiffMeta]:
-        self.fetch()
+        if self.no_fetch:
+            logging.info("Skipping fetch, as requested")
+        elif self._fetched_recently():
+            logging.info("Skipping fetch, as we fetched recently")
+        else:
+            self.fetch()
 
         commits_to_submit_and_boundary = self.parse_revs()
 
@@ -431,15 +460,19 @@ class Submitter:
             d for d in commits_to_submit_and_boundary if not d.boundary
         ]
 
-        # NB: A little bit of redundant parsing here, because we will re-parse
-        # commits that we had already parsed in commits_to_submit, and we will
-        # also parse prefix even if it's not being processed, but it's at most ~10
-        # extra parses so whatever
-        commits_to_rebase_and_boundary = ghstack.git.split_header(
-            self.sh.git(
-                "rev-list",
+        if self.stack and not self.revs:
+            # The common case: we are submitting everything reachable from
+            # HEAD, so the rebase set is exactly what parse_revs walked; no
+            # need to ask rev-list for it again.
+            commits_to_rebase_and_boundary = commits_to_submit_and_boundary
+        else:
+            # NB: A little bit of redundant parsing here, because we will re-parse
+            # commits that we had already parsed in commits_to_submit, and we will
+            # also parse prefix even if it's not being processed, but it's at most ~10
+            # extra parses so whatever
+            commits_to_rebase_and_boundary = ghstack.git.rev_list(
+                self.sh,
                 "--boundary",
-                "--header",
                 "--topo-order",
                 # Get all commits reachable from HEAD...
                 "HEAD",
@@ -448,7 +481,6 @@ class Submitter:
                 # ...but we don't need any commits that aren't draft
                 f"^{self.remote_name}/{self.base}",
             )
-        )
 
         commits_to_rebase = [
             d for d in commits_to_rebase_and_boundary if not d.boundary
@@ -484,21 +516,22 @@ class Submitter:
         # check_invariants code small, as it counts as TCB
         pre_branch_state_index: Dict[GitCommitHash, PreBranchState] = {}
         if self.check_invariants:
-            for h in commits_to_submit:
-                d = ghstack.git.convert_header(h, self.github_url)
+            diffs = [
+                ghstack.git.convert_header(h, self.github_url)
+                for h in commits_to_submit
+            ]
+            pull_requests = self.fetch_pull_requests(diffs)
+            for h, d in zip(commits_to_submit, diffs):
                 if d.pull_request_resolved is not None:
-                    ed = self.elaborate_diff(d)
+                    ed = self.elaborate_diff(d, pull_requests=pull_requests)
+                    head_commit_id, base_commit_id = ghstack.git.rev_parse(
+                        self.sh,
+                        f"{self.remote_name}/{ed.head_ref}",
+                        f"{self.remote_name}/{ed.base_ref}",
+                    )
                     pre_branch_state_index[h.commit_id] = PreBranchState(
-                        head_commit_id=GitCommitHash(
-                            self.sh.git(
-                                "rev-parse", f"{self.remote_name}/{ed.head_ref}"
-                            )
-                        ),
-                        base_commit_id=GitCommitHash(
-                            self.sh.git(
-                                "rev-parse", f"{self.remote_name}/{ed.base_ref}"
-                            )
-                        ),
+                        head_commit_id=head_commit_id,
+                        base_commit_id=base_commit_id,
                     )
 
         # NB: deduplicates
@@ -573,6 +606,24 @@ class Submitter:
             self.remote_name,
             f"+refs/heads/*:refs/remotes/{self.remote_name}/*",
         )
+        ghstack.cache.put("git_fetch", self._fetch_cache_key(), str(time.time()))
+
+    def _fetch_cache_key(self) -> str:
+        # NB: FETCH_HEAD is touched by any fetch (even one of a single
+        # branch), so it doesn't tell us whether all of the remote's
+        # branches are up to date; we record our own fetches instead
+        git_dir = os.path.join(
+            self.sh.cwd, self.sh.git("rev-parse", "--git-common-dir")
+        )
+        return f"{os.path.realpath(git_dir)}:{self.remote_name}"
+
+    def _fetched_recently(self) -> bool:
+        if self.fetch_max_age is None:
+            return False
+        last_fetch = ghstack.cache.get("git_fetch", self._fetch_cache_key())
+        if last_fetch is None:
+            return False
+        return time.time() - float(last_fetch) < self.fetch_max_age
 
     def parse_revs(self) -> List[ghstack.git.CommitHeader]:
         # There are two distinct usage patterns:
@@ -631,19 +682,16 @@ class Submitter:
         # unrelated reasons, and we don't want to treat them as non-draft if
         # this happens!
 
-        commits_to_submit_and_boundary = []
+        commits_to_submit_and_boundary: List[ghstack.git.CommitHeader] = []
         if self.stack:
             # Easy case, make rev-list do the hard work
             commits_to_submit_and_boundary.extend(
-                ghstack.git.split_header(
-                    self.sh.git(
-                        "rev-list",
-                        "--header",
-                        "--topo-order",
-                        "--boundary",
-                        *revs,
-                        f"^{self.remote_name}/{self.base}",
-                    ),
+                ghstack.git.rev_list(
+                    self.sh,
+                    "--topo-order",
+                    "--boundary",
+                    *revs,
+                    f"^{self.remote_name}/{self.base}",
                 )
             )
         else:
@@ -686,6 +734,18 @@ class Submitter:
         submit_set = set(h.commit_id for h in commits_to_submit)
         diff_meta_index: Dict[GitCommitHash, DiffMeta] = {}
         rebase_index: Dict[GitCommitHash, GitCommitHash] = {}
+        diffs = {}
+        for commit in commits_to_rebase:
+            diff = ghstack.git.convert_header(commit, self.github_url)
+            # Do not process poisoned commits.  This only needs the local
+            # commit, so check it before we go asking GitHub about the PR
+            if "[ghstack-poisoned]" in diff.summary:
+                self._raise_poisoned()
+            diffs[commit.commit_id] = diff
+        # Look up all of the existing pull requests in one go
+        pull_requests = self.fetch_pull_requests(
+            diffs[h.commit_id] for h in commits_to_submit
+        )
         for commit in reversed(commits_to_rebase):
             submit = commit.commit_id in submit_set
             parents = commit.parents
@@ -700,13 +760,13 @@ class Submitter:
             diff_meta = None
             parent_commit = commit_index[parent]
             parent_diff_meta = diff_meta_index.get(parent)
-            diff = ghstack.git.convert_header(commit, self.github_url)
+            diff = diffs[commit.commit_id]
             diff_meta = self.process_commit(
                 parent_commit,
                 parent_diff_meta,
                 diff,
                 (
-                    self.elaborate_diff(diff)
+                    self.elaborate_diff(diff, pull_requests=pull_requests)
                     if diff.pull_request_resolved is not None
                     else None
                 ),
@@ -764,24 +824,11 @@ class Submitter:
 
         return diff_meta_index, rebase_index
 
-    def elaborate_diff(
-        self, diff: ghstack.diff.Diff, *, is_ghexport: bool = False
-    ) -> DiffWithGitHubMetadata:
-        """
-        Query GitHub API for the current title, body and closed? status
-        of the pull request corresponding to a ghstack.diff.Diff.
-        """
-
-        assert diff.pull_request_resolved is not None
-        assert diff.pull_request_resolved.owner == self.repo_owner
-        assert diff.pull_request_resolved.repo == self.repo_name
-
-        number = diff.pull_request_resolved.number
+    def _pull_request_read(self, number: GitHubNumber) -> ghstack.github.GraphQLRead:
         # TODO: There is no reason to do a node query here; we can
         # just look up the repo the old fashioned way
-        r = self.github.graphql(
+        return ghstack.github.GraphQLRead(
             """
-          query ($repo_id: ID!, $number: Int!) {
             node(id: $repo_id) {
               ... on Repository {
                 pullRequest(number: $number) {
@@ -793,14 +840,55 @@ class Submitter:
                 }
               }
             }
-          }
-        """,
-            repo_id=self.repo_id,
-            number=number,
-        )["data"]["node"]["pullRequest"]
+            """,
+            {"repo_id": ("ID!", self.repo_id), "number": ("Int!", number)},
+        )
+
+    def fetch_pull_requests(
+        self, diffs: Iterable[ghstack.diff.Diff]
+    ) -> Dict[GitHubNumber, Any]:
+        """
+        Query GitHub API for the pull requests corresponding to several
+        ghstack.diff.Diff at once, for use with elaborate_diff.
+        """
+        numbers = list(
+            {
+                diff.pull_request_resolved.number: None
+                for diff in diffs
+                if diff.pull_request_resolved is not None
+            }
+        )
+        results = self.github.batch_graphql(
+            [self._pull_request_read(number) for number in numbers]
+        )
+        return {number: r["pullRequest"] for number, r in zip(numbers, results)}
+
+    def elaborate_diff(
+        self,
+        diff: ghstack.diff.Diff,
+        *,
+        is_ghexport: bool = False,
+        pull_requests: Optional[Dict[GitHubNumber, Any]] = None,
+    ) -> DiffWithGitHubMetadata:
+        """
+        Query GitHub API for the current title, body and closed? status
+        of the pull request corresponding to a ghstack.diff.Diff.  If
+        you already fetched it with fetch_pull_requests, pass the result
+        as pull_requests to skip the query.
+        """
+
+        assert diff.pull_request_resolved is not None
+        assert diff.pull_request_resolved.owner == self.repo_owner
+        assert diff.pull_request_resolved.repo == self.repo_name
+
+        number = diff.pull_request_resolved.number
+        if pull_requests is not None and number in pull_requests:
+            r = pull_requests[number]
+        else:
+            r = self.fetch_pull_requests([diff])[number]
 
         # Sorry, this is a big hack to support the ghexport case
-        m = re.match(r"(refs/heads/)?export-D([0-9]+)$", r["headRefName"])
+        m = RE_GHEXPORT_HEAD_REF.match(r["headRefName"])
         if m is not None and is_ghexport:
             raise RuntimeError(
                 """\
@@ -820,7 +908,7 @@ the line 'Pull Request resolved' and then run ghexport again.
             )
 
         # TODO: Hmm, I'm not sure why this matches
-        m = re.match(r"gh/([^/]+)/([0-9]+)/head$", r["headRefName"])
+        m = RE_GH_HEAD_REF.match(r["headRefName"])
         if m is None:
             if is_ghexport:
                 raise RuntimeError(
@@ -910,9 +998,7 @@ to disassociate the commit with the pull request, and then try again.
         elab_diff: Optional[DiffWithGitHubMetadata],
         submit: bool,
     ) -> Optional[DiffMeta]:
-        # Do not process poisoned commits
-        if "[ghstack-poisoned]" in diff.summary:
-            self._raise_poisoned()
+        # NB: poisoned commits were already rejected by prepare_updates
 
         # Do not process closed commits
         if elab_diff is not None and elab_diff.closed:
@@ -1099,25 +1185,39 @@ is closed (likely due to being merged).  Please rebase to upstream and try again
             )
         return summary
 
-    # NB: mutates GhBranch
-    def _resolve_gh_branch(
-        self, kind: str, gh_branch: GhBranch, username: str, ghnum: GhNumber
-    ) -> None:
-        remote_ref = self.remote_name + "/" + branch(username, ghnum, kind)
-        (remote_commit,) = ghstack.git.split_header(
-            self.sh.git("rev-list", "--header", "-1", remote_ref)
-        )
-        gh_branch.commit = GhCommit(remote_commit.commit_id, remote_commit.tree)
-
     # Precondition: these branches exist
     def _resolve_gh_branches(self, username: str, ghnum: GhNumber) -> GhBranches:
         push_branches = GhBranches()
-        self._resolve_gh_branch("orig", push_branches.orig, username, ghnum)
-        self._resolve_gh_branch("head", push_branches.head, username, ghnum)
+        gh_branches = {
+            "orig": push_branches.orig,
+            "head": push_branches.head,
+        }
         if self.direct:
-            self._resolve_gh_branch("next", push_branches.next, username, ghnum)
+            gh_branches["next"] = push_branches.next
         else:
-            self._resolve_gh_branch("base", push_branches.base, username, ghnum)
+            gh_branches["base"] = push_branches.base
+        remote_refs = {
+            kind: f"refs/remotes/{self.remote_name}/{branch(username, ghnum, kind)}"
+            for kind in gh_branches
+        }
+        # Look up all of the branches with a single for-each-ref, rather
+        # than spawning a rev-list per branch
+        resolved = {}
+        for line in self.sh.git(
+            "for-each-ref",
+            "--format=%(refname) %(objectname) %(tree) %(parent)",
+            *remote_refs.values(),
+        ).splitlines():
+            ref, commit_id, tree, *parents = line.split()
+            resolved[ref] = GhCommit(
+                GitCommitHash(commit_id),
+                tree,
+                tuple(GitCommitHash(p) for p in parents),
+            )
+        for kind, gh_branch in gh_branches.items():
+            if remote_refs[kind] not in resolved:
+                raise RuntimeError(f"Could not find branch {remote_refs[kind]}")
+            gh_branch.commit = resolved[remote_refs[kind]]
         return push_branches
 
     def _create_non_orig_branches(
@@ -1220,12 +1320,20 @@ is closed (likely due to being merged).  Please rebase to upstream and try again
                 extra_base = self.sh.git(
                     "merge-base", base.commit_id, f"{self.remote_name}/{self.base}"
                 )
-                if push_branches.base.commit is None or not self.sh.git(
-                    "merge-base",
-                    "--is-ancestor",
-                    extra_base,
-                    push_branches.base.commit.commit_id,
-                    exitcode=True,
+                # NB: when the stack hasn't been rebased, extra_base is
+                # still a parent of the previous base commit, in which case
+                # we can skip asking git if it is an ancestor
+                old_base = push_branches.base.commit
+                if old_base is None or (
+                    extra_base != old_base.commit_id
+                    and extra_base not in old_base.parents
+                    and not self.sh.git(
+                        "merge-base",
+                        "--is-ancestor",
+                        extra_base,
+                        old_base.commit_id,
+                        exitcode=True,
+                    )
                 ):
                     base_args.extend(("-p", extra_base))
                 new_base = GitCommitHash(
@@ -1528,13 +1636,15 @@ is closed (likely due to being merged).  Please rebase to upstream and try again
                     q = push_branches
                 q.append(push_spec(diff, branch(s.username, s.ghnum, b)))
         # Careful!  Don't push master.
-        # TODO: These pushes need to be atomic (somehow)
+        # NB: base branches go out in their own push first, for the reason
+        # described above.  Everything else goes out in one atomic push; the
+        # orig branches are force pushed with a + refspec, so only they are
+        # allowed to be non-fast-forward updates.
         if base_push_branches:
             self._git_push(base_push_branches)
+        push_branches.extend("+" + b for b in force_push_branches)
         if push_branches:
             self._git_push(push_branches)
-        if force_push_branches:
-            self._git_push(force_push_branches, force=True)
 
         # Report what happened
         def format_url(s: DiffMeta) -> str:
@@ -1605,7 +1715,7 @@ is closed (likely due to being merged).  Please rebase to upstream and try again
         pre_branch_state: Optional[PreBranchState],
     ) -> None:
         def is_git_commit_hash(h: str) -> bool:
-            return re.match(r"[a-f0-9]{40}", h) is not None
+            return RE_GIT_COMMIT_HASH.match(h) is not None
 
         def assert_eq(a: Any, b: Any) -> None:
             assert a == b, f"{a} != {b}"
@@ -1791,15 +1901,10 @@ is closed (likely due to being merged).  Please rebase to upstream and try again
             )
         return title, pr_body
 
-    def _git_push(self, branches: Sequence[str], force: bool = False) -> None:
+    def _git_push(self, branches: Sequence[str]) -> None:
         assert branches, "empty branches would push master, probably bad!"
         try:
-            self.sh.git(
-                "push",
-                self.remote_name,
-                *(["--force"] if force else []),
-                *branches,
-            )
+            self.sh.git("push", "--atomic", self.remote_name, *branches)
         except RuntimeError as e:
             remote_url = self.sh.git("remote", "get-url", "--push", self.remote_name)
             if remote_url.startswith("https://"):
@@ -1817,14 +1922,11 @@ def run_pre_ghstack_hook(
     sh: ghstack.shell.Shell, base_commit: str, top_commit: str
 ) -> None:
     """If a `pre-ghstack` git hook is configured, run it."""
-    default_hooks_path = os.path.join(
-        sh.git("rev-parse", "--show-toplevel"), ".git/hooks"
-    )
     try:
-        hooks_path = sh.git(
-            "config", "--default", default_hooks_path, "--get", "core.hooksPath"
-        )
-        hook_file = os.path.join(hooks_path, "pre-ghstack")
+        # NB: --git-path takes core.hooksPath into account, and is relative
+        # to the shell's cwd
+        hooks_path = sh.git("rev-parse", "--git-path", "hooks")
+        hook_file = os.path.join(sh.cwd, hooks_path, "pre-ghstack")
     except Exception as e:
         logging.warning(f"Pre ghstack hook failed: {e}")
         return
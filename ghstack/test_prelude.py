@@ -189,6 +189,8 @@ def gh_submit(
     base: Optional[str] = None,
     revs: Sequence[str] = (),
     stack: bool = True,
+    fetch_max_age: Optional[float] = None,
+    no_fetch: bool = False,
 ) -> List[ghstack.submit.DiffMeta]:
     self = CTX
     r = ghstack.submit.main(
@@ -208,6 +210,8 @@ def gh_submit(
         base_opt=base,
         revs=revs,
         stack=stack,
+        fetch_max_age=fetch_max_age,
+        no_fetch=no_fetch,
         check_invariants=True,
     )
     self.check_global_github_invariants(self.direct)
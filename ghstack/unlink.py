@@ -48,9 +48,7 @@ def main(
     # Parse the commits
     parsed_commits: Optional[Set[GitCommitHash]] = None
     if commits:
-        parsed_commits = set()
-        for c in commits:
-            parsed_commits.add(GitCommitHash(sh.git("rev-parse", c)))
+        parsed_commits = set(ghstack.git.rev_parse(sh, *commits))
 
     base = GitCommitHash(
         sh.git("merge-base", f"{remote_name}/{default_branch}", "HEAD")
@@ -58,9 +56,7 @@ def main(
 
     # compute the stack of commits in chronological order (does not
     # include base)
-    stack = ghstack.git.split_header(
-        sh.git("rev-list", "--reverse", "--header", "^" + base, "HEAD")
-    )
+    stack = ghstack.git.rev_list(sh, "--reverse", "^" + base, "HEAD")
 
     # sanity check the parsed_commits
     if parsed_commits is not None: